@@ -0,0 +1,181 @@
+# times the core of the game (map generation, monster turns, FOV and map drawing, saving and loading, whole turns)
+# at several map sizes and monster densities, and writes the results as JSON so runs can be compared.
+#
+#   python benchmark.py [--seed N] [--repeat N] [--generator NAME] [--stages NAME,...] [--output results.json]
+#                       [--baseline old_results.json]
+
+__author__ = "Steven Sarasin <tutoringsteve@gmail.com>"
+
+import argparse
+import collections
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+import libtcodpy as libtcod
+import myfirstrl as game
+
+# (width, height) of the map
+MAP_SIZES = [(80, 45), (160, 90), (320, 180)]
+# the most monsters a room can have
+MONSTER_DENSITIES = [3, 10]
+
+# the most turns played in each run of the turn throughput benchmark
+TURNS_PER_RUN = 200
+
+
+def seed_rng(seed):
+    # new_game picks the game's seed, that everything else follows from, from the default generator
+    libtcod.random_restore(0, libtcod.random_new_from_seed(seed))
+
+
+def configure(width, height, max_room_monsters):
+    # resize the map, keeping the same number of rooms per tile as the normal 80x45 map
+    game.MAP_WIDTH = width
+    game.MAP_HEIGHT = height
+    game.MAX_ROOMS = max(1, 26 * width * height / (80 * 45))
+    game.MAX_ROOM_MONSTERS = max_room_monsters
+    game.con = libtcod.console_new(width, height)
+
+
+def time_it(func, repeat, setup=None):
+    # run func repeat times and return the timings in milliseconds. setup, if given, runs untimed before each call.
+    timings = []
+    for i in xrange(repeat):
+        if setup is not None:
+            setup()
+        start = timeit.default_timer()
+        func()
+        timings.append((timeit.default_timer() - start) * 1000.0)
+    return {'min_ms': min(timings), 'mean_ms': sum(timings) / len(timings), 'runs': repeat}
+
+
+def time_stages(repeat, seed):
+    # time each of the level generation stages on its own, as timings named after them
+    timings = collections.defaultdict(list)
+    for i in xrange(repeat):
+        seed_rng(seed)
+        game.make_map()
+        for name, seconds in game.stage_timings.items():
+            timings[name].append(seconds * 1000.0)
+    return dict(('stage_' + name, {'min_ms': min(stage), 'mean_ms': sum(stage) / len(stage), 'runs': repeat})
+                for name, stage in timings.items())
+
+
+def start_ai_round():
+    # every monster starts the round awake, as on entering the level, with the player's view worked out, so the ones
+    # in view chase and attack while those with nothing to do go back to sleep
+    game.schedule_actors()
+    game.fov_recompute = True
+    game.update_fov()
+
+
+def force_fov_redraw():
+    game.fov_recompute = True
+    game.map_renderer = game.MapRenderer(game.MAP_WIDTH, game.MAP_HEIGHT)
+
+
+def time_turns(repeat, seed):
+    # play up to TURNS_PER_RUN turns of a new game repeat times and return the timings in milliseconds per turn. a
+    # run stops early when the player dies, so the timings go by the turns it actually took.
+    timings = []
+    turns_played = []
+    for i in xrange(repeat):
+        seed_rng(seed)
+        game.new_game()
+        start = timeit.default_timer()
+        turns = game.play_headless(game.random_commands(), TURNS_PER_RUN)
+        elapsed = (timeit.default_timer() - start) * 1000.0
+        if turns < TURNS_PER_RUN:
+            print >> sys.stderr, 'warning: %dx%d, %d monsters/room: a run ended after %d of %d turns (%s)' % (
+                game.MAP_WIDTH, game.MAP_HEIGHT, game.MAX_ROOM_MONSTERS, turns, TURNS_PER_RUN, game.game_state)
+        turns_played.append(turns)
+        timings.append(elapsed / max(turns, 1))
+    return {'min_ms': min(timings), 'mean_ms': sum(timings) / len(timings), 'runs': repeat,
+            'turns_per_run': TURNS_PER_RUN, 'turns_played': turns_played}
+
+
+def run_case(width, height, max_room_monsters, seed, repeat, save_dir):
+    configure(width, height, max_room_monsters)
+    seed_rng(seed)
+    game.new_game()
+    save_file = os.path.join(save_dir, 'savegame')
+
+    results = {'map_width': width, 'map_height': height, 'max_room_monsters': max_room_monsters}
+    results['make_map'] = time_it(game.make_map, repeat, setup=lambda: seed_rng(seed))
+    results.update(time_stages(repeat, seed))
+    game.initialize_fov()
+    results['objects'] = len(game.objects)
+    results['monsters'] = sum(1 for obj in game.objects if obj.AI)
+
+    results['ai_round'] = time_it(game.take_monster_turns, repeat, setup=start_ai_round)
+    results['fov_and_draw_map'] = time_it(game.draw_map_panel, repeat, setup=force_fov_redraw)
+    results['save_game'] = time_it(lambda: game.save_game(save_file), repeat)
+    results['load_game'] = time_it(lambda: game.load_game(save_file), repeat)
+    results['turn'] = time_turns(repeat, seed)
+    return results
+
+
+def compare(results, baseline):
+    # print how much slower (> 1) or faster (< 1) every benchmark got since the baseline run
+    old_cases = dict(((case['map_width'], case['map_height'], case['max_room_monsters']), case)
+                     for case in baseline['cases'])
+    for case in results['cases']:
+        old = old_cases.get((case['map_width'], case['map_height'], case['max_room_monsters']))
+        if old is None:
+            continue
+        for name, timing in sorted(case.items()):
+            if isinstance(timing, dict) and name in old:
+                print '%dx%d, %d monsters/room, %s: %.2fx' % (case['map_width'], case['map_height'],
+                                                              case['max_room_monsters'], name,
+                                                              timing['min_ms'] / old[name]['min_ms'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the core game loop.')
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--generator', choices=sorted(game.ROOM_GENERATORS), default=game.MAP_GENERATOR,
+                        help='how the rooms of the maps are laid out (default: %(default)s)')
+    parser.add_argument('--stages', default=','.join(game.GENERATION_STAGES),
+                        help='the stages levels are generated in, in order, separated by commas (out of %s, '
+                             'default: %%(default)s)' % ', '.join(sorted(game.LEVEL_STAGES)))
+    parser.add_argument('--output', help='file to write the results to (default: standard output)')
+    parser.add_argument('--baseline', help='results of an earlier run to compare against')
+    args = parser.parse_args()
+    stages = tuple(args.stages.split(','))
+    try:
+        game.check_stages(stages)
+    except ValueError as e:
+        parser.error(str(e))
+
+    game.MAP_GENERATOR = args.generator
+    game.GENERATION_STAGES = stages
+    results = {'seed': args.seed, 'repeat': args.repeat, 'generator': args.generator, 'stages': list(stages),
+               'python': platform.python_version(), 'platform': platform.platform(), 'cases': []}
+    save_dir = tempfile.mkdtemp()
+    try:
+        for width, height in MAP_SIZES:
+            for max_room_monsters in MONSTER_DENSITIES:
+                results['cases'].append(run_case(width, height, max_room_monsters, args.seed, args.repeat, save_dir))
+    finally:
+        shutil.rmtree(save_dir)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -40,6 +40,11 @@ try:  #import NumPy if available
 except ImportError:
     numpy_available = False
 
+
+def _require_numpy(what):
+    if not numpy_available:
+        raise ImportError(what + ' requires NumPy.')
+
 LINUX = False
 MAC = False
 MINGW = False
@@ -390,6 +395,109 @@ def color_gen_map(colors, indexes):
     return cres
 
 
+# batched versions of the color functions above, working on NumPy arrays of colors: uint8 arrays whose last axis is
+# (r, g, b). they take Colors, sequences of Colors or (r, g, b) tuples, or such arrays, and return arrays, which can
+# go straight into a ConsoleArrays or ConsoleBuffer (or be turned back into a Color with Color(*array)). the results
+# match what the single color functions give, give or take rounding.
+def colors_array(colors):
+    _require_numpy('colors_array')
+    if isinstance(colors, Color):
+        colors = tuple(colors)
+    elif isinstance(colors, (tuple, list)) and len(colors) == 3 and \
+            all(isinstance(c, (int, long, numpy.integer)) for c in colors):
+        # a single (r, g, b) color
+        colors = tuple(colors)
+    elif not isinstance(colors, numpy.ndarray):
+        colors = [tuple(color) for color in colors]
+    return numpy.asarray(colors, dtype=numpy.uint8)
+
+
+def _channels(colors):
+    # colors as signed ints, so arithmetic on them can go out of range before being clipped back
+    return colors_array(colors).astype(numpy.int32)
+
+
+def _coefficients(coef):
+    # a coefficient per color, lined up against their channels
+    coef = numpy.asarray(coef, dtype=numpy.float32)
+    return coef[..., numpy.newaxis] if coef.ndim else coef
+
+
+def _to_colors(channels):
+    return numpy.clip(channels, 0, 255).astype(numpy.uint8)
+
+
+def colors_equal(c1, c2):
+    return (colors_array(c1) == colors_array(c2)).all(axis=-1)
+
+
+def colors_multiply(c1, c2):
+    return _to_colors(_channels(c1) * _channels(c2) // 255)
+
+
+def colors_scale(c, coef):
+    # multiply colors by a float, or by an array of floats with one per color
+    return _to_colors((_channels(c) * _coefficients(coef)).astype(numpy.int32))
+
+
+def colors_add(c1, c2):
+    return _to_colors(_channels(c1) + _channels(c2))
+
+
+def colors_subtract(c1, c2):
+    return _to_colors(_channels(c1) - _channels(c2))
+
+
+def colors_lerp(c1, c2, a):
+    # a can be a float, or an array of floats with one per color
+    c1 = _channels(c1)
+    return _to_colors((c1 + (_channels(c2) - c1) * _coefficients(a)).astype(numpy.int32))
+
+
+def colors_get_hsv(colors):
+    # returns arrays of hue (0 to 360), saturation and value (0 to 1)
+    rgb = colors_array(colors).astype(numpy.float32) / 255
+    maximum = rgb.max(axis=-1)
+    minimum = rgb.min(axis=-1)
+    delta = maximum - minimum
+    safe_delta = numpy.where(delta == 0, 1, delta)
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    h = numpy.where(maximum == r, (g - b) / safe_delta,
+                    numpy.where(maximum == g, 2 + (b - r) / safe_delta, 4 + (r - g) / safe_delta)) * 60
+    h = numpy.where(delta == 0, 0, h % 360)
+    s = numpy.where(maximum == 0, 0, delta / numpy.where(maximum == 0, 1, maximum))
+    return h, s, maximum
+
+
+def colors_from_hsv(h, s, v):
+    # the colors for arrays of hue, saturation and value, as colors_get_hsv returns
+    h, s, v = numpy.broadcast_arrays(numpy.asarray(h, dtype=numpy.float32) % 360 / 60,
+                                     numpy.asarray(s, dtype=numpy.float32), numpy.asarray(v, dtype=numpy.float32))
+    sector = numpy.minimum(numpy.floor(h), 5).astype(numpy.int32)
+    f = h - sector
+    p = v * (1 - s)
+    q = v * (1 - s * f)
+    t = v * (1 - s * (1 - f))
+    # r, g and b for each of the six sectors of the color wheel
+    r = numpy.choose(sector, (v, q, p, p, t, v))
+    g = numpy.choose(sector, (t, v, v, q, p, p))
+    b = numpy.choose(sector, (p, p, t, v, v, q))
+    return _to_colors(numpy.stack((r, g, b), axis=-1) * 255 + 0.5)
+
+
+def colors_scale_hsv(colors, scoef, vcoef):
+    h, s, v = colors_get_hsv(colors)
+    return colors_from_hsv(h, numpy.clip(s * scoef, 0, 1), numpy.clip(v * vcoef, 0, 1))
+
+
+def colors_gen_map(colors, indexes):
+    # as color_gen_map, but returns a (max(indexes) + 1, 3) array
+    keys = _channels(colors)
+    positions = numpy.arange(max(indexes) + 1)
+    return numpy.stack([numpy.interp(positions, indexes, keys[:, channel]) for channel in xrange(3)],
+                       axis=-1).astype(numpy.uint8)
+
+
 ############################
 # console module
 ############################
@@ -405,87 +513,197 @@ class Key(Structure):
                 ]
 
 
-class ConsoleBuffer:
-    # simple console that allows direct (fast) access to cells. simplifies
-    # use of the "fill" functions.
+class ConsoleArrays:
+    # the characters and colors of a whole console as NumPy arrays. char is indexed [y, x], fore and back are indexed
+    # [y, x, channel]. they are views on buffers allocated once, laid out the way libtcod's "fill" functions read
+    # them, so flushing them to a console is a single call per layer with nothing converted or allocated. write into
+    # them (console.back[y, x] = ..., console.char[:] = ...) rather than assigning new arrays to them.
+    def __init__(self, width, height, back=(0, 0, 0), fore=(0, 0, 0), char=' '):
+        _require_numpy('ConsoleArrays')
+        self.width = width
+        self.height = height
+        self._char = numpy.zeros((height, width), dtype=numpy.intc)
+        self._fore = numpy.zeros((3, height, width), dtype=numpy.intc)
+        self._back = numpy.zeros((3, height, width), dtype=numpy.intc)
+        self.char = self._char
+        self.fore = self._fore.transpose(1, 2, 0)
+        self.back = self._back.transpose(1, 2, 0)
+        # the pointers handed to libtcod, made once
+        self._char_pointer = self._char.ctypes.data_as(POINTER(c_int))
+        self._fore_pointers = [plane.ctypes.data_as(POINTER(c_int)) for plane in self._fore]
+        self._back_pointers = [plane.ctypes.data_as(POINTER(c_int)) for plane in self._back]
+        self.clear(back, fore, char)
+
+    def clear(self, back=(0, 0, 0), fore=(0, 0, 0), char=' '):
+        # fill every cell with the given colors and character. defaults to black with no characters.
+        self.back[:] = back
+        self.fore[:] = fore
+        self.char.fill(ord(char))
+
+    def flush(self, dest, fill_fore=True, fill_back=True, fill_char=True):
+        # write the arrays to a console of the same size.
+        if (console_get_width(dest) != self.width or
+                console_get_height(dest) != self.height):
+            raise ValueError('ConsoleArrays.flush: Destination console has an incorrect size.')
+
+        if fill_back:
+            _lib.TCOD_console_fill_background(dest, *self._back_pointers)
+        if fill_fore:
+            _lib.TCOD_console_fill_foreground(dest, *self._fore_pointers)
+        if fill_char:
+            _lib.TCOD_console_fill_char(dest, self._char_pointer)
+
+
+class ConsoleBuffer(object):
+    # off-screen console that allows direct (fast) access to cells, kept in NumPy arrays (see ConsoleArrays). whole
+    # rectangles or masks of cells can be filled at once, and any part of it can be blitted to a console. snapshots
+    # share the arrays with the buffer they were taken from until either of them is changed.
+    # unlike the rest of this module, it needs NumPy: it used to keep its cells in Python lists, and back_r...fore_b
+    # and char were those lists. char is now an array indexed [y, x], and the channels are flat arrays that can be
+    # assigned to as a whole but not changed in place (set them through back and fore instead).
     def __init__(self, width, height, back_r=0, back_g=0, back_b=0, fore_r=0, fore_g=0, fore_b=0, char=' '):
         # initialize with given width and height. values to fill the buffer
         # are optional, defaults to black with no characters.
-        n = width * height
+        _require_numpy('ConsoleBuffer')
         self.width = width
         self.height = height
         self.clear(back_r, back_g, back_b, fore_r, fore_g, fore_b, char)
 
+    def _arrays_to_write(self):
+        # the arrays, first copied if they are shared with a snapshot
+        if self._shared:
+            arrays = ConsoleArrays(self.width, self.height)
+            arrays.char[:] = self._arrays.char
+            arrays.fore[:] = self._arrays.fore
+            arrays.back[:] = self._arrays.back
+            self._arrays = arrays
+            self._shared = False
+        return self._arrays
+
+    # the cells as arrays: char indexed [y, x], fore and back indexed [y, x, channel]. getting one counts as changing
+    # the buffer, since it can be written to.
+    char = property(lambda self: self._arrays_to_write().char)
+    fore = property(lambda self: self._arrays_to_write().fore)
+    back = property(lambda self: self._arrays_to_write().back)
+
+    def _channel(layer, channel):
+        # one color channel of the fore or back layer on its own, as a flat array indexed width * y + x. getting it
+        # gives a copy; setting it takes a value per cell in the same order.
+        def get(self):
+            return getattr(self, layer)[..., channel].ravel()
+
+        def set(self, values):
+            getattr(self, layer)[..., channel] = numpy.reshape(values, (self.height, self.width))
+
+        return property(get, set)
+
+    back_r = _channel('back', 0)
+    back_g = _channel('back', 1)
+    back_b = _channel('back', 2)
+    fore_r = _channel('fore', 0)
+    fore_g = _channel('fore', 1)
+    fore_b = _channel('fore', 2)
+    del _channel
+
     def clear(self, back_r=0, back_g=0, back_b=0, fore_r=0, fore_g=0, fore_b=0, char=' '):
         # clears the console. values to fill it with are optional, defaults
         # to black with no characters.
-        n = self.width * self.height
-        self.back_r = [back_r] * n
-        self.back_g = [back_g] * n
-        self.back_b = [back_b] * n
-        self.fore_r = [fore_r] * n
-        self.fore_g = [fore_g] * n
-        self.fore_b = [fore_b] * n
-        self.char = [ord(char)] * n
+        self._arrays = ConsoleArrays(self.width, self.height, (back_r, back_g, back_b), (fore_r, fore_g, fore_b), char)
+        self._shared = False
 
-    def copy(self):
-        # returns a copy of this ConsoleBuffer.
-        other = ConsoleBuffer(0, 0)
+    def snapshot(self):
+        # returns a copy of this ConsoleBuffer that shares its arrays until either is changed.
+        other = ConsoleBuffer.__new__(ConsoleBuffer)
         other.width = self.width
         other.height = self.height
-        other.back_r = list(self.back_r)  # make explicit copies of all lists
-        other.back_g = list(self.back_g)
-        other.back_b = list(self.back_b)
-        other.fore_r = list(self.fore_r)
-        other.fore_g = list(self.fore_g)
-        other.fore_b = list(self.fore_b)
-        other.char = list(self.char)
+        other._arrays = self._arrays
+        other._shared = self._shared = True
+        return other
+
+    def copy(self):
+        # returns a copy of this ConsoleBuffer.
+        other = self.snapshot()
+        other._arrays_to_write()
         return other
 
     def set_fore(self, x, y, r, g, b, char):
         # set the character and foreground color of one cell.
-        i = self.width * y + x
-        self.fore_r[i] = r
-        self.fore_g[i] = g
-        self.fore_b[i] = b
-        self.char[i] = ord(char)
+        arrays = self._arrays_to_write()
+        arrays.fore[y, x] = (r, g, b)
+        arrays.char[y, x] = ord(char)
 
     def set_back(self, x, y, r, g, b):
         # set the background color of one cell.
-        i = self.width * y + x
-        self.back_r[i] = r
-        self.back_g[i] = g
-        self.back_b[i] = b
+        self._arrays_to_write().back[y, x] = (r, g, b)
 
     def set(self, x, y, back_r, back_g, back_b, fore_r, fore_g, fore_b, char):
         # set the background color, foreground color and character of one cell.
-        i = self.width * y + x
-        self.back_r[i] = back_r
-        self.back_g[i] = back_g
-        self.back_b[i] = back_b
-        self.fore_r[i] = fore_r
-        self.fore_g[i] = fore_g
-        self.fore_b[i] = fore_b
-        self.char[i] = ord(char)
-
-    def blit(self, dest, fill_fore=True, fill_back=True):
-        # use libtcod's "fill" functions to write the buffer to a console.
-        if (console_get_width(dest) != self.width or
-                    console_get_height(dest) != self.height):
-            raise ValueError('ConsoleBuffer.blit: Destination console has an incorrect size.')
-
-        s = struct.Struct('%di' % len(self.back_r))
-
-        if fill_back:
-            _lib.TCOD_console_fill_background(dest, (c_int * len(self.back_r))(*self.back_r),
-                                              (c_int * len(self.back_g))(*self.back_g),
-                                              (c_int * len(self.back_b))(*self.back_b))
-
-        if fill_fore:
-            _lib.TCOD_console_fill_foreground(dest, (c_int * len(self.fore_r))(*self.fore_r),
-                                              (c_int * len(self.fore_g))(*self.fore_g),
-                                              (c_int * len(self.fore_b))(*self.fore_b))
-            _lib.TCOD_console_fill_char(dest, (c_int * len(self.char))(*self.char))
+        arrays = self._arrays_to_write()
+        arrays.back[y, x] = (back_r, back_g, back_b)
+        arrays.fore[y, x] = (fore_r, fore_g, fore_b)
+        arrays.char[y, x] = ord(char)
+
+    def fill_rect(self, x, y, w, h, back=None, fore=None, char=None):
+        # set the background color, foreground color and/or character (whichever are given) of every cell in the
+        # rectangle. colors are (r, g, b) tuples or Colors. parts outside the buffer are ignored.
+        x1, y1 = max(x, 0), max(y, 0)
+        x2, y2 = min(x + w, self.width), min(y + h, self.height)
+        if x1 < x2 and y1 < y2:
+            self._fill(numpy.s_[y1:y2, x1:x2], back, fore, char)
+
+    def fill_mask(self, mask, back=None, fore=None, char=None):
+        # as fill_rect, for the cells set in mask, a boolean array indexed [y, x] the size of the buffer.
+        self._fill(numpy.asarray(mask, dtype=bool), back, fore, char)
+
+    def _fill(self, cells, back, fore, char):
+        arrays = self._arrays_to_write()
+        if back is not None:
+            arrays.back[cells] = tuple(back)
+        if fore is not None:
+            arrays.fore[cells] = tuple(fore)
+        if char is not None:
+            arrays.char[cells] = ord(char)
+
+    # scratch consoles the size of a blitted region, with arrays to stage the region in, by (width, height)
+    _scratch = {}
+
+    def blit(self, dest, fill_fore=True, fill_back=True, x=0, y=0, w=0, h=0, xdst=0, ydst=0):
+        # write the rectangle at (x, y) of size (w, h) (0 meaning up to the edge, as in console_blit) to a console at
+        # (xdst, ydst): the background colors if fill_back, the characters and their colors if fill_fore, exactly as
+        # they are in the buffer. the whole buffer to a console of the same size goes straight through libtcod's
+        # "fill" functions. anything else is staged in a scratch console the size of the region, which console_blit
+        # then copies over whole, since at full alpha it copies cells as they are. when only one of the layers is
+        # written, the scratch console first gets the region of dest, so the other layer goes back unchanged.
+        if w == 0:
+            w = self.width - x
+        if h == 0:
+            h = self.height - y
+        if (x, y, w, h, xdst, ydst) == (0, 0, self.width, self.height, 0, 0) and \
+                console_get_width(dest) == self.width and console_get_height(dest) == self.height:
+            self._arrays.flush(dest, fill_fore, fill_back, fill_fore)
+            return
+        if not (fill_fore or fill_back):
+            return
+
+        # the parts outside either console are left out
+        x1, y1 = max(0, -x, -xdst), max(0, -y, -ydst)
+        x2 = min(w, self.width - x, console_get_width(dest) - xdst)
+        y2 = min(h, self.height - y, console_get_height(dest) - ydst)
+        if x1 >= x2 or y1 >= y2:
+            return
+        w, h = x2 - x1, y2 - y1
+        x, y, xdst, ydst = x + x1, y + y1, xdst + x1, ydst + y1
+
+        if (w, h) not in ConsoleBuffer._scratch:
+            ConsoleBuffer._scratch[w, h] = (console_new(w, h), ConsoleArrays(w, h))
+        scratch, arrays = ConsoleBuffer._scratch[w, h]
+        if not (fill_fore and fill_back):
+            console_blit(dest, xdst, ydst, w, h, scratch, 0, 0, 1.0, 1.0)
+        arrays.char[:] = self._arrays.char[y:y + h, x:x + w]
+        arrays.fore[:] = self._arrays.fore[y:y + h, x:x + w]
+        arrays.back[:] = self._arrays.back[y:y + h, x:x + w]
+        arrays.flush(scratch, fill_fore, fill_back, fill_fore)
+        console_blit(scratch, 0, 0, w, h, dest, xdst, ydst, 1.0, 1.0)
 
 
 _lib.TCOD_console_credits_render.restype = c_bool
@@ -990,9 +1208,9 @@ def console_fill_foreground(con, r, g, b):
     if (numpy_available and isinstance(r, numpy.ndarray) and
             isinstance(g, numpy.ndarray) and isinstance(b, numpy.ndarray)):
         #numpy arrays, use numpy's ctypes functions
-        r = numpy.ascontiguousarray(r, dtype=numpy.int_)
-        g = numpy.ascontiguousarray(g, dtype=numpy.int_)
-        b = numpy.ascontiguousarray(b, dtype=numpy.int_)
+        r = numpy.ascontiguousarray(r, dtype=numpy.intc)
+        g = numpy.ascontiguousarray(g, dtype=numpy.intc)
+        b = numpy.ascontiguousarray(b, dtype=numpy.intc)
         cr = r.ctypes.data_as(POINTER(c_int))
         cg = g.ctypes.data_as(POINTER(c_int))
         cb = b.ctypes.data_as(POINTER(c_int))
@@ -1012,9 +1230,9 @@ def console_fill_background(con, r, g, b):
     if (numpy_available and isinstance(r, numpy.ndarray) and
             isinstance(g, numpy.ndarray) and isinstance(b, numpy.ndarray)):
         #numpy arrays, use numpy's ctypes functions
-        r = numpy.ascontiguousarray(r, dtype=numpy.int_)
-        g = numpy.ascontiguousarray(g, dtype=numpy.int_)
-        b = numpy.ascontiguousarray(b, dtype=numpy.int_)
+        r = numpy.ascontiguousarray(r, dtype=numpy.intc)
+        g = numpy.ascontiguousarray(g, dtype=numpy.intc)
+        b = numpy.ascontiguousarray(b, dtype=numpy.intc)
         cr = r.ctypes.data_as(POINTER(c_int))
         cg = g.ctypes.data_as(POINTER(c_int))
         cb = b.ctypes.data_as(POINTER(c_int))
@@ -1030,7 +1248,7 @@ def console_fill_background(con, r, g, b):
 def console_fill_char(con, arr):
     if (numpy_available and isinstance(arr, numpy.ndarray) ):
         #numpy arrays, use numpy's ctypes functions
-        arr = numpy.ascontiguousarray(arr, dtype=numpy.int_)
+        arr = numpy.ascontiguousarray(arr, dtype=numpy.intc)
         carr = arr.ctypes.data_as(POINTER(c_int))
     else:
         #otherwise convert using the struct module
@@ -1586,6 +1804,13 @@ def random_get_int(rnd, mi, ma):
     return _lib.TCOD_random_get_int(rnd, mi, ma)
 
 
+def random_get_ints(rnd, mi, ma, n):
+    # n integers, the same ones n calls to random_get_int would give. libtcod has no call drawing several at once,
+    # so this only saves the wrapper's overhead on each of them.
+    get_int = _lib.TCOD_random_get_int
+    return [get_int(rnd, mi, ma) for i in xrange(n)]
+
+
 def random_get_float(rnd, mi, ma):
     return _lib.TCOD_random_get_float(rnd, c_float(mi), c_float(ma))
 
@@ -1687,6 +1912,9 @@ FOV_PERMISSIVE_7 = 10
 FOV_PERMISSIVE_8 = 11
 FOV_RESTRICTIVE = 12
 NB_FOV_ALGORITHMS = 13
+# the algorithms that keep no state outside of the call, so several threads can compute with them at once. the
+# others (diamond, permissive and restrictive) work in file-level globals of libtcod.
+_FOV_REENTRANT = (FOV_BASIC, FOV_SHADOW)
 
 
 def FOV_PERMISSIVE(p):
@@ -1705,6 +1933,43 @@ def map_set_properties(m, x, y, isTrans, isWalk):
     _lib.TCOD_map_set_properties(m, x, y, c_int(isTrans), c_int(isWalk))
 
 
+# a libtcod map as laid out in memory, so that all of its cells can be read or written in one go. every cell is a
+# single byte holding its transparent, walkable and fov flags as bits 0, 1 and 2.
+class _CMap(Structure):
+    _fields_ = [('width', c_int),
+                ('height', c_int),
+                ('nbcells', c_int),
+                ('cells', POINTER(c_uint8)),
+                ]
+
+
+_MAP_CELL_TRANSPARENT = 1
+_MAP_CELL_WALKABLE = 2
+_MAP_CELL_FOV = 4
+
+
+# fast map filling
+def map_fill_properties(m, transparent, walkable):
+    # set the transparency and walkability of every cell with a single copy. both buffers hold one value per cell in
+    # row-major order (index y * width + x), like the console fill functions. this also clears the fov, as map_clear
+    # does.
+    cmap = cast(m, POINTER(_CMap)).contents
+    if (numpy_available and isinstance(transparent, numpy.ndarray) and
+            isinstance(walkable, numpy.ndarray)):
+        if transparent.size != cmap.nbcells or walkable.size != cmap.nbcells:
+            raise TypeError('transparent and walkable must have one value per map cell.')
+        cells = numpy.where(transparent.ravel(), _MAP_CELL_TRANSPARENT, 0).astype(numpy.uint8)
+        cells |= numpy.where(walkable.ravel(), _MAP_CELL_WALKABLE, 0).astype(numpy.uint8)
+        data = cells.tostring()
+    else:
+        if len(transparent) != cmap.nbcells or len(walkable) != cmap.nbcells:
+            raise TypeError('transparent and walkable must have one value per map cell.')
+        data = struct.pack('%dB' % cmap.nbcells,
+                           *[(_MAP_CELL_TRANSPARENT if t else 0) | (_MAP_CELL_WALKABLE if w else 0)
+                             for t, w in zip(transparent, walkable)])
+    memmove(cmap.cells, data, cmap.nbcells)
+
+
 def map_clear(m, walkable=False, transparent=False):
     _lib.TCOD_map_clear(m, c_int(walkable), c_int(transparent))
 
@@ -1717,6 +1982,58 @@ def map_is_in_fov(m, x, y):
     return _lib.TCOD_map_is_in_fov(m, x, y)
 
 
+def map_get_fov(m):
+    # the fov flag of every cell, read in one go after map_compute_fov. returns a (height, width) NumPy boolean array
+    # if NumPy is available, otherwise a row-major list.
+    cmap = cast(m, POINTER(_CMap)).contents
+    if numpy_available:
+        cells = numpy.frombuffer(string_at(cmap.cells, cmap.nbcells), dtype=numpy.uint8)
+        return (cells & _MAP_CELL_FOV).astype(bool).reshape(cmap.height, cmap.width)
+    return [bool(cmap.cells[i] & _MAP_CELL_FOV) for i in xrange(cmap.nbcells)]
+
+
+def map_compute_fov_batch(m, origins, radius=0, light_walls=True, algo=FOV_RESTRICTIVE, pool=None, workers=4):
+    # compute the fov from every (x, y) in origins against the transparency of m, which is left as it is. returns
+    # what map_get_fov would after each one: a (len(origins), height, width) NumPy boolean array if NumPy is
+    # available, otherwise a list of row-major lists. with a pool (anything with a map method, such as a
+    # multiprocessing.pool.ThreadPool), the origins are split between up to workers tasks, each working on its own
+    # copy of m. ctypes releases the GIL while libtcod computes, so the tasks run side by side, but only for
+    # FOV_BASIC and FOV_SHADOW: the other algorithms aren't safe to run on several threads at once, so for them the
+    # pool is ignored and the origins are done one after the other.
+    origins = list(origins)
+    if algo not in _FOV_REENTRANT:
+        pool = None
+    if pool is None or len(origins) < 2:
+        groups = [origins]
+    else:
+        size = -(-len(origins) // min(workers, len(origins)))
+        groups = [origins[i:i + size] for i in xrange(0, len(origins), size)]
+
+    def compute(group):
+        scratch = map_new(map_get_width(m), map_get_height(m))
+        try:
+            # computing the fov clears the previous one, so a single copy does for the whole group
+            map_copy(m, scratch)
+            fovs = []
+            for x, y in group:
+                map_compute_fov(scratch, x, y, radius, light_walls, algo)
+                fovs.append(map_get_fov(scratch))
+            return fovs
+        finally:
+            map_delete(scratch)
+
+    if pool is None:
+        results = map(compute, groups)
+    else:
+        results = pool.map(compute, groups)
+    fovs = [fov for group_fovs in results for fov in group_fovs]
+    if numpy_available:
+        if not fovs:
+            return numpy.zeros((0, map_get_height(m), map_get_width(m)), dtype=bool)
+        return numpy.array(fovs)
+    return fovs
+
+
 def map_is_transparent(m, x, y):
     return _lib.TCOD_map_is_transparent(m, x, y)
 
@@ -3,9 +3,20 @@ from functools import partial
 __author__ = "Steven Sarasin <tutoringsteve@gmail.com>"
 
 import libtcodpy as libtcod
+import atexit
+import collections
+import heapq
+import itertools
 import math
+import multiprocessing.pool
+import os
+import shutil
+import struct
+import sys
+import tempfile
 import textwrap
-import shelve
+import timeit
+import numpy
 
 # size of the map
 MAP_WIDTH = 80
@@ -27,6 +38,19 @@ ROOM_MAX_SIZE = 10
 ROOM_MIN_SIZE = 6
 MAX_ROOMS = 26
 
+# how the rooms of a level are laid out (see ROOM_GENERATORS): 'rooms' tries MAX_ROOMS random rooms, keeping the ones
+# that don't overlap any kept before them, 'bsp' splits the map up into about MAX_ROOMS parts and puts a room in each
+MAP_GENERATOR = 'rooms'
+# the most one side of a part of the map can be longer than the other, for the 'bsp' generator
+BSP_MAX_RATIO = 1.5
+
+# the stages a level is generated in, in order (see LEVEL_STAGES). levels are generated again from their seed when
+# they are loaded, so a save only loads the same with the same stages (and MAP_GENERATOR).
+GENERATION_STAGES = ('rooms', 'populate', 'stairs')
+# for the 'caves' stage: the chance of each tile starting out as a wall and how many times the walls are smoothed
+CAVE_WALL_CHANCE = 0.45
+CAVE_SMOOTHING_STEPS = 4
+
 MAX_ROOM_MONSTERS = 3
 MAX_ROOM_ITEMS = 2
 
@@ -50,108 +74,676 @@ CONFUSE_RANGE = 8
 FIREBALL_RADIUS = 3
 FIREBALL_DAMAGE = 12
 
+# flashes of light (from explosions) light up their surroundings for this many turns, the one they happen in included
+FLASH_TURNS = 2
+FIREBALL_FLASH_RADIUS = 2 * FIREBALL_RADIUS
+
 PHASE_DOOR_DISTANCE = 3
 
+# how many of the most recently left levels are kept in memory, ready to go back to. older ones are written to disk.
+LEVEL_CACHE_SIZE = 4
+
+# how many of the latest messages are kept (and saved)
+MESSAGE_LOG_SIZE = 100
+
 LIMIT_FPS = 20
 
+# how long an action takes an actor of normal speed. an actor twice as fast acts twice as often.
+ACTION_COST = 100
+NORMAL_SPEED = 100
+# paths are forgotten in one go when they add up to more steps than this
+MAX_CACHED_PATH_STEPS = 10000
+
+# threads working out what the monsters can see, when there are enough of them to be worth splitting up
+VISION_WORKERS = 4
+
+# how far away sleeping monsters can hear things
+COMBAT_NOISE_RADIUS = 5
+EXPLOSION_NOISE_RADIUS = 12
+THUNDER_NOISE_RADIUS = 15
+
 color_dark_wall = libtcod.Color(r=0, g=0, b=100)
 color_lit_wall = libtcod.Color(r=130, g=110, b=50)
 color_dark_ground = libtcod.Color(r=50, g=50, b=150)
 color_lit_ground = libtcod.Color(r=200, g=180, b=50)
 
 
-class Tile:
-    # a tile of the map and its properties
-    def __init__(self, blocked, block_sight=None):
-        self.blocked = blocked
-        self.explored = False
+class Tile(object):
+    # a tile of the map and its properties. this is only a view onto one cell of a TileMap, reading and writing its
+    # properties goes straight through to the map's layers
+    __slots__ = ('tile_map', 'x', 'y')
+
+    def __init__(self, tile_map, x, y):
+        self.tile_map = tile_map
+        self.x = x
+        self.y = y
+
+    @property
+    def blocked(self):
+        return bool(self.tile_map.blocked[self.x, self.y])
+
+    @blocked.setter
+    def blocked(self, value):
+        self.tile_map.blocked[self.x, self.y] = value
+
+    @property
+    def block_sight(self):
+        return bool(self.tile_map.block_sight[self.x, self.y])
+
+    @block_sight.setter
+    def block_sight(self, value):
+        self.tile_map.block_sight[self.x, self.y] = value
+
+    @property
+    def explored(self):
+        return bool(self.tile_map.explored[self.x, self.y])
+
+    @explored.setter
+    def explored(self, value):
+        self.tile_map.explored[self.x, self.y] = value
+
+
+class TileColumn(object):
+    # one column of a TileMap, so that tile_map[x][y] keeps working
+    __slots__ = ('tile_map', 'x')
+
+    def __init__(self, tile_map, x):
+        self.tile_map = tile_map
+        self.x = x
+
+    def __getitem__(self, y):
+        return Tile(self.tile_map, self.x, y)
+
+
+class TileMap(object):
+    # the tiles of the map, stored as one boolean array per property and indexed [x, y] (so blocked[x, y] is the same
+    # tile as tile_map[x][y].blocked). whole-map work should use the arrays directly instead of going tile by tile.
+    def __init__(self, width, height, blocked=True, block_sight=None):
+        self.width = width
+        self.height = height
 
         # by default, if a tile is blocked, it also blocks sight
         if block_sight is None:
             block_sight = blocked
-        self.block_sight = block_sight
+        self.blocked = numpy.empty((width, height), dtype=bool)
+        self.blocked.fill(blocked)
+        self.block_sight = numpy.empty((width, height), dtype=bool)
+        self.block_sight.fill(block_sight)
+        self.explored = numpy.zeros((width, height), dtype=bool)
+        # goes up every time the layout of the map changes, so anything worked out from it knows when to redo it
+        self.version = 0
+        # the rectangles (x1, y1, x2, y2) that changed, oldest first, for things that only need redoing where it did
+        self.changes = []
+
+    def __getitem__(self, x):
+        return TileColumn(self, x)
+
+    def pack_explored(self):
+        # the explored layer as packed bits, one byte per 8 tiles. it is the only one a level record needs, since the
+        # rest of the map doesn't change once it has been generated.
+        return numpy.packbits(self.explored).tostring()
+
+    def unpack_explored(self, data, offset=0):
+        # set the explored layer from what pack_explored() returned, starting at offset in data. returns the offset
+        # after it.
+        size = self.width * self.height
+        bits = numpy.frombuffer(data, dtype=numpy.uint8, count=(size + 7) / 8, offset=offset)
+        self.explored = numpy.unpackbits(bits)[:size].reshape(self.width, self.height).astype(bool)
+        return offset + bits.size
+
+    def __len__(self):
+        return self.width
+
+    def carve(self, x1, y1, x2, y2):
+        # make the tiles from (x1, y1) up to but not including (x2, y2) passable. parts outside the map are ignored.
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2, self.width), min(y2, self.height)
+        if x1 < x2 and y1 < y2:
+            self.blocked[x1:x2, y1:y2] = False
+            self.block_sight[x1:x2, y1:y2] = False
+            self.version += 1
+            self.changes.append((x1, y1, x2, y2))
+
+    def carve_mask(self, mask):
+        # make the tiles where the boolean [x, y] mask is set passable
+        xs, ys = numpy.nonzero(mask & self.blocked)
+        if xs.size:
+            self.blocked[mask] = False
+            self.block_sight[mask] = False
+            self.version += 1
+            self.changes.append((int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1))
+
+
+def dilate(mask):
+    # grow a boolean [x, y] mask by one tile in all 8 directions
+    rows = mask.copy()
+    rows[1:, :] |= mask[:-1, :]
+    rows[:-1, :] |= mask[1:, :]
+    grown = rows.copy()
+    grown[:, 1:] |= rows[:, :-1]
+    grown[:, :-1] |= rows[:, 1:]
+    return grown
+
+
+# the 8 directions, in the order DistanceField.step tries them
+DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (1, -1), (-1, 1), (1, 1))
+
+
+class DistanceField:
+    # the number of steps (in 8 directions) from every passable tile of the map to a goal tile, worked out once and
+    # then shared by every monster heading for the goal: each one just steps to a neighbouring tile that is closer.
+    # libtcod's dijkstra works the distances out in C, on its own copy of the map's walkability.
+    UNREACHABLE = float('inf')
+
+    def __init__(self):
+        self.tile_map = None
+        # tile_map.version the walk map was copied at
+        self.version = None
+        self.walk_map = None
+        self.dijkstra = None
+        self.goal = None
+
+    def update(self, tile_map, x, y):
+        # make it the field towards (x, y) on tile_map, unless it already is
+        if tile_map is not self.tile_map:
+            self.clear()
+            self.tile_map = tile_map
+            self.walk_map = libtcod.map_new(tile_map.width, tile_map.height)
+            # diagonal steps cost the same as straight ones
+            self.dijkstra = libtcod.dijkstra_new(self.walk_map, 1.0)
+        if tile_map.version != self.version:
+            libtcod.map_fill_properties(self.walk_map, ~tile_map.block_sight.T, ~tile_map.blocked.T)
+            self.version = tile_map.version
+            self.goal = None
+        if (x, y) != self.goal:
+            libtcod.dijkstra_compute(self.dijkstra, x, y)
+            self.goal = (x, y)
+
+    def distance(self, x, y):
+        distance = libtcod.dijkstra_get_distance(self.dijkstra, x, y)
+        if distance < 0:
+            return DistanceField.UNREACHABLE
+        return distance
+
+    def clear(self):
+        if self.dijkstra is not None:
+            libtcod.dijkstra_delete(self.dijkstra)
+            libtcod.map_delete(self.walk_map)
+        self.tile_map = self.version = self.walk_map = self.dijkstra = self.goal = None
+
+    def step(self, x, y):
+        # the direction (dx, dy) to go in from (x, y) to get closer to the goal, or None if there is no free tile that
+        # gets closer
+        best = self.distance(x, y)
+        best_step = None
+        for dx, dy in DIRECTIONS:
+            to_x, to_y = x + dx, y + dy
+            if in_map(to_x, to_y) and self.distance(to_x, to_y) < best and not is_blocked(to_x, to_y):
+                best = self.distance(to_x, to_y)
+                best_step = (dx, dy)
+        return best_step
+
+
+# the way to the player, for the monsters chasing them
+player_field = DistanceField()
+
+
+class PathService:
+    # shortest paths between tiles, worked out by libtcod and kept until the map changes under them. a path from a to b
+    # is also the way to b from every tile along it, so following one costs a single lookup per step. libtcod finds
+    # the paths on its own copy of the map's walkability, so it never calls back into Python while searching.
+    def __init__(self):
+        self.tile_map = None
+        self.walk_map = None
+        self.path = None
+        # how many of tile_map.changes walk_map is up to date with
+        self.seen_changes = 0
+        # (tile, destination) -> (route, index of tile in route). a route is the tuple of tiles from its origin to its
+        # destination.
+        self.steps = {}
+        # tile -> the routes over it
+        self.routes_over = {}
+
+    def next_step(self, tile_map, x, y, dest_x, dest_y):
+        # the tile to go to from (x, y) on the shortest way to (dest_x, dest_y), or None if there is no way there
+        if (x, y) == (dest_x, dest_y):
+            return None
+        self.sync(tile_map)
+        key = ((x, y), (dest_x, dest_y))
+        if key not in self.steps:
+            if not libtcod.path_compute(self.path, x, y, dest_x, dest_y):
+                return None
+            route = ((x, y),) + tuple(libtcod.path_get(self.path, i) for i in xrange(libtcod.path_size(self.path)))
+            self.remember(route)
+        route, index = self.steps[key]
+        return route[index + 1]
+
+    def sync(self, tile_map):
+        # bring walk_map up to date with tile_map, forgetting the routes over the tiles that changed
+        if tile_map is not self.tile_map:
+            self.clear()
+            self.tile_map = tile_map
+            self.walk_map = libtcod.map_new(tile_map.width, tile_map.height)
+            libtcod.map_fill_properties(self.walk_map, ~tile_map.block_sight.T, ~tile_map.blocked.T)
+            self.path = libtcod.path_new_using_map(self.walk_map)
+        else:
+            for x1, y1, x2, y2 in tile_map.changes[self.seen_changes:]:
+                for x in xrange(x1, x2):
+                    for y in xrange(y1, y2):
+                        libtcod.map_set_properties(self.walk_map, x, y, not tile_map.block_sight[x, y],
+                                                   not tile_map.blocked[x, y])
+                        for route in self.routes_over.pop((x, y), ()):
+                            self.forget(route)
+        self.seen_changes = len(tile_map.changes)
+
+    def remember(self, route):
+        if len(self.steps) > MAX_CACHED_PATH_STEPS:
+            self.steps.clear()
+            self.routes_over.clear()
+        destination = route[-1]
+        for index, tile in enumerate(route[:-1]):
+            self.steps[tile, destination] = (route, index)
+        for tile in route:
+            self.routes_over.setdefault(tile, set()).add(route)
+
+    def forget(self, route):
+        destination = route[-1]
+        for tile in route[:-1]:
+            if self.steps.get((tile, destination), (None,))[0] is route:
+                del self.steps[tile, destination]
+        for tile in route:
+            self.routes_over.get(tile, set()).discard(route)
+
+    def clear(self):
+        if self.path is not None:
+            libtcod.path_delete(self.path)
+            libtcod.map_delete(self.walk_map)
+        self.tile_map = self.walk_map = self.path = None
+        self.steps.clear()
+        self.routes_over.clear()
+
+
+path_service = PathService()
+
+
+class Level:
+    # everything about a level the player has left: its tiles, the objects on it (the player aside), its FOV map and
+    # where the player was standing
+    def __init__(self, tile_map, objects, fov_map, player_x, player_y):
+        self.tile_map = tile_map
+        self.objects = objects
+        self.fov_map = fov_map
+        self.player_x = player_x
+        self.player_y = player_y
+
+
+class LevelStore:
+    # the levels the player has left, by depth, so that going back to one restores it instead of generating a new
+    # one. the most recently left levels are kept as they are; once there are more than capacity, the least recently
+    # used ones lose their FOV map (it is rebuilt from the tiles when needed) and are written to disk as level records
+    # (see encode_level).
+    def __init__(self, capacity=LEVEL_CACHE_SIZE):
+        self.capacity = capacity
+        # depth -> Level, least recently used first
+        self.levels = collections.OrderedDict()
+        # depth -> file of a level written to disk
+        self.spilled = {}
+        self.directory = None
+        # depth -> the entity records of a level's objects as generated, which level records are relative to
+        self.baselines = {}
+
+    def put(self, depth, level):
+        self.levels.pop(depth, None)
+        self.levels[depth] = level
+        while len(self.levels) > self.capacity:
+            old_depth, old_level = self.levels.popitem(last=False)
+            self.spill(old_depth, old_level)
+
+    def take(self, depth):
+        # remove and return the level at depth, or None if there isn't one
+        if depth in self.levels:
+            return self.levels.pop(depth)
+        if depth in self.spilled:
+            filename = self.spilled.pop(depth)
+            with open(filename, 'rb') as f:
+                depth, tile_map, objects, player_x, player_y = decode_level(f.read())
+            os.remove(filename)
+            return Level(tile_map, objects, None, player_x, player_y)
+        return None
+
+    def spill(self, depth, level):
+        libtcod.map_delete(level.fov_map)
+        self.put_record(depth, encode_level(depth, level.tile_map, level.objects, level.player_x, level.player_y))
+
+    def put_record(self, depth, record):
+        # store a level that is already encoded, straight to disk
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix='firstrl-levels-')
+        filename = os.path.join(self.directory, 'level%d' % depth)
+        with open(filename, 'wb') as f:
+            f.write(record)
+        self.spilled[depth] = filename
+
+    def records(self):
+        # every stored level, encoded
+        for depth, level in self.levels.items():
+            yield encode_level(depth, level.tile_map, level.objects, level.player_x, level.player_y)
+        for filename in self.spilled.values():
+            with open(filename, 'rb') as f:
+                yield f.read()
+
+    def baseline(self, depth):
+        if depth not in self.baselines:
+            self.baselines[depth] = generate_level(depth)[4]
+        return self.baselines[depth]
+
+    def clear(self):
+        for level in self.levels.values():
+            libtcod.map_delete(level.fov_map)
+        self.levels.clear()
+        self.baselines.clear()
+        self.remove_spilled()
+
+    def remove_spilled(self):
+        # delete the levels written to disk, along with their directory
+        self.spilled.clear()
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+
+level_store = LevelStore()
+# levels written to disk don't outlive the game
+atexit.register(level_store.remove_spilled)
+
+# the current level
+tile_map = None
+objects = None
 
 
 def change_depth(depth_to_change_by):
+    # move the player to another level, restoring it if they have been there before. returns whether the level is a
+    # newly generated one.
     global current_depth
 
+    # keep the level being left, so it is still there when the player comes back
+    objects.remove(player)
+    level_store.put(current_depth, Level(tile_map, objects, fov_map, player.x, player.y))
+
     if depth_to_change_by + current_depth < 0:
         current_depth = 0
     else:
         current_depth += depth_to_change_by
 
-    libtcod.console_clear(con)
-    make_map()
-    initialize_fov()
-    libtcod.console_flush()
+    if not headless:
+        libtcod.console_clear(con)
+        render_scheduler.invalidate()
+    level = level_store.take(current_depth)
+    if level is None:
+        make_map()
+        initialize_fov()
+    else:
+        restore_level(level)
+    if not headless:
+        libtcod.console_flush()
+    return level is None
+
+
+def restore_level(level):
+    global tile_map, objects, fov_map
+
+    tile_map = level.tile_map
+    objects = level.objects
+    player.x, player.y = level.player_x, level.player_y
+    objects.append(player)
+    schedule_actors()
+    if level.fov_map is None:
+        initialize_fov()
+    else:
+        fov_map = level.fov_map
+        reset_map_panel()
+
+
+# every part of the game that rolls dice has its own random number generator, so that, say, a confused monster
+# stumbling about can't change what the next level looks like. the map and spawn generators are reseeded from the
+# game's seed and the depth before each level is made, so a level can always be made again exactly as it was.
+RNG_STREAMS = ('map', 'spawn', 'combat', 'ai')
+rngs = {}
+
+
+def stream_seed(*numbers):
+    # a 32 bit seed mixed from the numbers given (FNV-1a over their 32 bit values)
+    seed = 0x811c9dc5
+    for number in numbers:
+        seed = ((seed ^ (number & 0xffffffff)) * 0x01000193) & 0xffffffff
+    return seed
+
+
+def seed_streams(names, *numbers):
+    # (re)start the named generators from a seed mixed from numbers
+    for name in names:
+        if name in rngs:
+            libtcod.random_delete(rngs[name])
+        rngs[name] = libtcod.random_new_from_seed(stream_seed(RNG_STREAMS.index(name), *numbers))
 
 
 def make_map():
     global tile_map, objects
-    global num_downstairs, num_upstairs
 
-    objects = [player]
+    tile_map, objects, player_x, player_y, baseline = generate_level(current_depth)
+    level_store.baselines[current_depth] = baseline
+    player.x, player.y = player_x, player_y
+    objects.append(player)
+    schedule_actors()
 
-    rooms = []
-    num_rooms = 0
-    num_downstairs = 0
-    num_upstairs = 0
-
-    # fill map with "unblocked" tiles
-    tile_map = [[Tile(blocked=True) for y in xrange(MAP_HEIGHT)] for x in xrange(MAP_WIDTH)]
 
+def random_rooms(rng):
+    # yields the rooms of a level, trying MAX_ROOMS random ones and keeping those that don't overlap an earlier one.
+    # the rooms are only drawn from rng as they are needed, so anything else drawn from it in between stays put.
+    rooms = []
     for r in xrange(MAX_ROOMS):
         # random width and height
-        w = libtcod.random_get_int(0, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
-        h = libtcod.random_get_int(0, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
-        x = libtcod.random_get_int(0, 0, MAP_WIDTH - w - 1)
-        y = libtcod.random_get_int(0, 0, MAP_HEIGHT - h - 1)
+        w, h = libtcod.random_get_ints(rng, ROOM_MIN_SIZE, ROOM_MAX_SIZE, 2)
+        x = libtcod.random_get_int(rng, 0, MAP_WIDTH - w - 1)
+        y = libtcod.random_get_int(rng, 0, MAP_HEIGHT - h - 1)
 
         new_room = Rect(x, y, w, h)
 
-        failed = False
         if in_map(x, y) and in_map(x + w, y + h):
-            for other_room in rooms:
-                if new_room.intersects(other_room):
-                    failed = True
-                    break
-        else:
-            failed = True
-            r -= 1
+            if not any(new_room.intersects(other_room) for other_room in rooms):
+                rooms.append(new_room)
+                yield new_room
+
+
+def bsp_rooms(rng):
+    # yields the rooms of a level, splitting the map in two, then each half in two and so on until there are about
+    # MAX_ROOMS parts (fewer if they would get too small for a room), and putting a random room in each part. the parts
+    # don't overlap, so neither do the rooms and none of them has to be tried again. the rooms come in the order of
+    # the parts from one side of the map to the other, so each one is near the one before.
+    # a room's walls are inside its part, so a part has to be a tile bigger than the smallest room
+    min_size = ROOM_MIN_SIZE + 1
+    root = libtcod.bsp_new_with_size(0, 0, MAP_WIDTH, MAP_HEIGHT)
+    try:
+        libtcod.bsp_split_recursive(root, rng, (MAX_ROOMS - 1).bit_length(), min_size, min_size, BSP_MAX_RATIO,
+                                    BSP_MAX_RATIO)
+        parts = []
+
+        def add_part(node, data):
+            if libtcod.bsp_is_leaf(node):
+                parts.append((node.x, node.y, node.w, node.h))
+            return True
+
+        libtcod.bsp_traverse_in_order(root, add_part)
+    finally:
+        libtcod.bsp_delete(root)
 
-        if not failed:
-            create_room(new_room)
-            # add some contents to this room, such as monsters
-            place_objects(new_room)
+    for part_x, part_y, part_w, part_h in parts:
+        w = libtcod.random_get_int(rng, ROOM_MIN_SIZE, min(ROOM_MAX_SIZE, part_w - 1))
+        h = libtcod.random_get_int(rng, ROOM_MIN_SIZE, min(ROOM_MAX_SIZE, part_h - 1))
+        x = libtcod.random_get_int(rng, part_x, part_x + part_w - 1 - w)
+        y = libtcod.random_get_int(rng, part_y, part_y + part_h - 1 - h)
+        yield Rect(x, y, w, h)
 
+
+ROOM_GENERATORS = {'rooms': random_rooms, 'bsp': bsp_rooms}
+
+
+class LevelBuilder:
+    # a level being generated, which the generation stages (see LEVEL_STAGES) work on in turn: its depth, the
+    # generator it is made from, its TileMap and ObjectList, the rooms carved so far and an object standing where the
+    # player will start
+    def __init__(self, depth, rng, tile_map, objects, start):
+        self.depth = depth
+        self.rng = rng
+        self.tile_map = tile_map
+        self.objects = objects
+        self.rooms = []
+        self.start = start
+
+
+def carve_rooms(level):
+    # carve the rooms laid out by the MAP_GENERATOR, joining each one to the one before it with a tunnel
+    for new_room in ROOM_GENERATORS[MAP_GENERATOR](level.rng):
+        create_room(level.tile_map, new_room)
+
+        if level.rooms:
+            # from second room and beyond connect via tunnel
             new_x, new_y = new_room.center()
+            prev_x, prev_y = level.rooms[-1].center()
 
-            if num_rooms == 0:
-                # place character center of first room
-                player.x, player.y = new_room.center()
+            # coin toss (random int either 0 or 1)
+            if libtcod.random_get_int(level.rng, 0, 1) == 1:
+                create_h_tunnel(level.tile_map, prev_x, new_x, prev_y)
+                create_v_tunnel(level.tile_map, new_x, prev_y, new_y)
             else:
-                # from second room and beyond connect via tunnel
-                prev_x, prev_y = rooms[-1].center()
+                create_v_tunnel(level.tile_map, prev_x, prev_y, new_y)
+                create_h_tunnel(level.tile_map, prev_x, new_x, new_y)
+        level.rooms.append(new_room)
+
+
+def carve_caves(level):
+    # grow caves out of what has been carved so far: start with random walls, smooth them into caves (a tile becomes
+    # a wall when more than 4 of its 8 neighbours are, and open when fewer than 4 are) and carve the caves that can be
+    # reached from the open tiles. the whole map is worked on at once, so it costs the same however many tiles change.
+    tile_map = level.tile_map
+    # one number from the level's generator seeds all the tiles' chances, keeping the caves the same for the same seed
+    tile_rng = numpy.random.RandomState(libtcod.random_get_int(level.rng, 0, 0x7fffffff))
+    walls = tile_rng.random_sample((tile_map.width, tile_map.height)) < CAVE_WALL_CHANCE
+    for i in xrange(CAVE_SMOOTHING_STEPS):
+        # off the map counts as wall
+        padded = numpy.ones((tile_map.width + 2, tile_map.height + 2), dtype=numpy.uint8)
+        padded[1:-1, 1:-1] = walls
+        neighbours = sum(padded[1 + dx:tile_map.width + 1 + dx, 1 + dy:tile_map.height + 1 + dy]
+                         for dx, dy in DIRECTIONS)
+        walls = (neighbours > 4) | (walls & (neighbours == 4))
+    caves = ~walls
+    # the tiles on the edge of the map stay walls
+    caves[0, :] = caves[-1, :] = caves[:, 0] = caves[:, -1] = False
+
+    reached = ~tile_map.blocked
+    while True:
+        grown = reached | (caves & dilate(reached))
+        if (grown == reached).all():
+            break
+        reached = grown
+    tile_map.carve_mask(reached)
 
-                # coin toss (random int either 0 or 1)
-                if libtcod.random_get_int(0, 0, 1) == 1:
-                    create_h_tunnel(prev_x, new_x, prev_y)
-                    create_v_tunnel(new_x, prev_y, new_y)
-                else:
-                    create_v_tunnel(prev_x, prev_y, new_y)
-                    create_h_tunnel(prev_x, new_x, new_y)
-            rooms.append(new_room)
-            num_rooms += 1
 
-    place_stairs(rooms)
+def populate_rooms(level):
+    # put the player in the first room, before anything else goes there, then add some contents to each room, such
+    # as monsters
+    level.start.x, level.start.y = level.rooms[0].center()
+    for new_room in level.rooms:
+        place_objects(new_room, level.depth)
+
+
+def place_stairs(level):
+    num_upstairs = 0
+    num_downstairs = 0
+    downstairs = libtcod.random_get_int(level.rng, MIN_DOWNSTAIRS, MAX_DOWNSTAIRS)
+    upstairs = libtcod.random_get_int(level.rng, MIN_UPSTAIRS, MAX_UPSTAIRS)
+    while num_downstairs < downstairs or num_upstairs < upstairs:
+        random_index = libtcod.random_get_int(level.rng, 0, len(level.rooms) - 1)
+        room = level.rooms[random_index]
+        x = libtcod.random_get_int(level.rng, room.x1 + 1, room.x2 - 1)
+        y = libtcod.random_get_int(level.rng, room.y1 + 1, room.y2 - 1)
+        if not is_blocked(x, y) and not any(obj.name == 'stairs' for obj in level.objects.at(x, y)):
+            dice = libtcod.random_get_int(level.rng, 0, 100)
+            if dice < 50 and num_upstairs < upstairs:
+                stair = Object(x, y, '<', 'stairs', always_visible=True, color=libtcod.white)
+                level.objects.append(stair)
+                stair.send_to_back()
+                num_upstairs += 1
+            elif num_downstairs < downstairs:
+                stair = Object(x, y, '>', 'stairs', always_visible=True, color=libtcod.white)
+                level.objects.append(stair)
+                stair.send_to_back()
+                num_downstairs += 1
+
+
+LEVEL_STAGES = {'rooms': carve_rooms, 'caves': carve_caves, 'populate': populate_rooms, 'stairs': place_stairs}
+# the stages that have to come before each stage, without which it would fail or do nothing ('caves' only grows out of
+# tiles that are already open). 'populate' is the one that decides where the player starts, so it is always needed.
+STAGE_PREREQUISITES = {'rooms': (), 'caves': ('rooms',), 'populate': ('rooms',), 'stairs': ('rooms',)}
+REQUIRED_STAGES = ('populate',)
+
+
+def check_stages(stages):
+    # raise a ValueError unless the stages can generate a level in the order given
+    for index, name in enumerate(stages):
+        if name not in LEVEL_STAGES:
+            raise ValueError("unknown stage '%s'" % name)
+        for prerequisite in STAGE_PREREQUISITES[name]:
+            if prerequisite not in stages[:index]:
+                raise ValueError("the '%s' stage has to come after the '%s' stage" % (name, prerequisite))
+    for name in REQUIRED_STAGES:
+        if name not in stages:
+            raise ValueError("the '%s' stage is missing" % name)
+
+# how long each of the GENERATION_STAGES took (in seconds) the last time a level was generated
+stage_timings = collections.OrderedDict()
+
+
+def generate_level(depth):
+    # make the level at depth, which comes out the same every time for the same game seed, leaving the current level
+    # as it is. returns the level's TileMap and ObjectList (without the player), where the player starts, and the
+    # entity records of its objects as generated. every object remembers where it came from as (depth, its index in
+    # the list), which is how level records (see encode_level) tell what was generated from what came later.
+    global tile_map, objects
+
+    check_stages(GENERATION_STAGES)
+    seed_streams(('map', 'spawn'), game_seed, depth)
+
+    # while it is being made, the new level is the current one as far as everything filling it is concerned
+    current_tile_map, current_objects = tile_map, objects
+    # fill map with "unblocked" tiles
+    tile_map = TileMap(MAP_WIDTH, MAP_HEIGHT, blocked=True)
+    # something standing in the player's place, so nothing is put there
+    stand_in = Object(0, 0, '@', 'player', libtcod.white, blocks=True)
+    objects = ObjectList([stand_in])
+    level = LevelBuilder(depth, rngs['map'], tile_map, objects, stand_in)
+
+    try:
+        stage_timings.clear()
+        for name in GENERATION_STAGES:
+            start = timeit.default_timer()
+            LEVEL_STAGES[name](level)
+            stage_timings[name] = timeit.default_timer() - start
+        objects.remove(stand_in)
+    finally:
+        tile_map, objects = current_tile_map, current_objects
+
+    for index, obj in enumerate(level.objects):
+        obj.origin = (depth, index)
+    return level.tile_map, level.objects, stand_in.x, stand_in.y, [encode_entity(obj) for obj in level.objects]
 
 
 def midpoint(x1, y1, x2, y2):
     return (x1 + x2) / 2, (y1 + y2) / 2
 
 
-def plus_or_minus_one():
-    zero_or_one = libtcod.random_get_int(0, 0, 1)
+def plus_or_minus_one(rng=0):
+    zero_or_one = libtcod.random_get_int(rng, 0, 1)
     return (-1) ** zero_or_one
 
 
@@ -174,24 +766,22 @@ def in_map(x, y):
 
 
 def is_blocked(x, y):
-    if tile_map[x][y].blocked:
+    if tile_map.blocked[x, y]:
         return True
-    for object in objects:
-        if object.blocks and ((object.x, object.y) == (x, y)):
-            return True
-    return False
+    return objects.blocking_at(x, y) is not None
 
 
 def target_tile(max_range=None):
     # return the position of a tile left-clicked in player's FOV (optionally with a further restricted range),
     # or (None, None) the user cancels targeting.
     global key, mouse
+    if script is not None:
+        return scripted_target_tile(max_range)
+
     while True:
         # Stop showing inventory and continues to render screen while targeting
-        libtcod.console_flush()
-        clear_all()
-        libtcod.sys_check_for_event(libtcod.EVENT_KEY_PRESS | libtcod.EVENT_MOUSE, key, mouse)
-        draw_all()
+        render_scheduler.render()
+        libtcod.sys_wait_for_event(libtcod.EVENT_KEY_PRESS | libtcod.EVENT_MOUSE, key, mouse, False)
 
         (x, y) = (mouse.cx - STAT_PANEL_WIDTH, mouse.cy)
 
@@ -204,38 +794,42 @@ def target_tile(max_range=None):
             return (None, None)
 
 
-def create_h_tunnel(x1, x2, y):
+def create_h_tunnel(tile_map, x1, x2, y):
     x1, x2 = min(x1, x2), max(x1, x2)
-    for x in xrange(x1, x2 + 1):
-        if in_map(x, y):
-            tile_map[x][y].blocked = False
-            tile_map[x][y].block_sight = False
+    tile_map.carve(x1, y, x2 + 1, y + 1)
 
 
-def create_v_tunnel(x, y1, y2):
+def create_v_tunnel(tile_map, x, y1, y2):
     y1, y2 = min(y1, y2), max(y1, y2)
-    for y in xrange(y1, y2 + 1):
-        if in_map(x, y):
-            tile_map[x][y].blocked = False
-            tile_map[x][y].block_sight = False
+    tile_map.carve(x, y1, x + 1, y2 + 1)
+
+
+def create_room(tile_map, room):
+    # make the tiles inside the rectangle (not its walls) passable
+    tile_map.carve(room.x1 + 1, room.y1 + 1, room.x2, room.y2)
 
 
-def create_room(room):
-    # go through the tiles in the rectangle and make them passable
-    for x in xrange(room.x1 + 1, room.x2):
-        for y in xrange(room.y1 + 1, room.y2):
-            if in_map(x, y):
-                tile_map[x][y].blocked = False
-                tile_map[x][y].block_sight = False
+# the game runs headless (without a window, drawing nothing) until init_window() is called
+headless = True
+con = None
+stat_con = None
+msg_con = None
 
+# when set, an iterator of commands that stands in for the keyboard and mouse (see play_headless)
+script = None
 
-libtcod.console_set_custom_font('fonts/arial10x10.png', libtcod.FONT_TYPE_GRAYSCALE | libtcod.FONT_LAYOUT_TCOD)
-libtcod.console_init_root(SCREEN_WIDTH, SCREEN_HEIGHT, 'python/libtcod tutorial', False)
-con = libtcod.console_new(MAP_WIDTH, MAP_HEIGHT)
-stat_con = libtcod.console_new(STAT_PANEL_WIDTH, STAT_PANEL_HEIGHT)
-msg_con = libtcod.console_new(MSG_PANEL_WIDTH, MSG_PANEL_HEIGHT)
-# will have no effect on turn-based games
-libtcod.sys_set_fps(LIMIT_FPS)
+
+def init_window():
+    global headless, con, stat_con, msg_con
+
+    libtcod.console_set_custom_font('fonts/arial10x10.png', libtcod.FONT_TYPE_GRAYSCALE | libtcod.FONT_LAYOUT_TCOD)
+    libtcod.console_init_root(SCREEN_WIDTH, SCREEN_HEIGHT, 'python/libtcod tutorial', False)
+    con = libtcod.console_new(MAP_WIDTH, MAP_HEIGHT)
+    stat_con = libtcod.console_new(STAT_PANEL_WIDTH, STAT_PANEL_HEIGHT)
+    msg_con = libtcod.console_new(MSG_PANEL_WIDTH, MSG_PANEL_HEIGHT)
+    # will have no effect on turn-based games
+    libtcod.sys_set_fps(LIMIT_FPS)
+    headless = False
 
 
 def render_bar(console, x, y, total_width, name, value, maximum, bar_color, back_color):
@@ -264,12 +858,63 @@ def possibly_plural_msg(quantity, name):
         return str(quantity) + ' ' + name + 's'
 
 
-def message(msg, color=libtcod.white, console=msg_con):
-    msg_width = libtcod.console_get_width(console)
-    msg_lines = textwrap.wrap(msg, msg_width)
+def message(msg, color=libtcod.white):
+    messages.add(msg, color)
+
+
+class MessageLog:
+    # the latest messages, oldest first. once there are capacity of them, each new one pushes the oldest one out. a
+    # message that repeats the latest one just counts it again, and is shown as "... x2". messages are wrapped into
+    # lines once for each width they are shown at, and version goes up every time the lines change.
+    # the most times a message is counted, as many as a message record (see encode_messages) can hold
+    MAX_COUNT = 0xFFFF
 
-    for line in reversed(msg_lines):
-        messages.append((line, color))
+    def __init__(self, capacity):
+        # [text, color, count]
+        self.entries = collections.deque(maxlen=capacity)
+        # width -> the lines of every entry wrapped to that width, in step with entries
+        self.wrapped = {}
+        self.version = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        # every message as (text, color, count)
+        for text, color, count in self.entries:
+            yield text, color, count
+
+    def add(self, text, color=libtcod.white, count=1):
+        latest = self.entries[-1] if self.entries else None
+        if latest is not None and latest[0] == text and tuple(latest[1]) == tuple(color):
+            latest[2] = min(latest[2] + count, MessageLog.MAX_COUNT)
+            for width, lines in self.wrapped.iteritems():
+                lines[-1] = MessageLog.wrap(latest, width)
+        else:
+            entry = [text, color, min(count, MessageLog.MAX_COUNT)]
+            self.entries.append(entry)
+            for width, lines in self.wrapped.iteritems():
+                lines.append(MessageLog.wrap(entry, width))
+        self.version += 1
+
+    @staticmethod
+    def wrap(entry, width):
+        text, color, count = entry
+        if count > 1:
+            text += ' x' + str(count)
+        return [(line, color) for line in textwrap.wrap(text, width)]
+
+    def lines(self, width, count):
+        # the latest count lines at the given width as (line, color), latest message first
+        if width not in self.wrapped:
+            self.wrapped[width] = collections.deque((MessageLog.wrap(entry, width) for entry in self.entries),
+                                                    maxlen=self.entries.maxlen)
+        lines = []
+        for entry_lines in reversed(self.wrapped[width]):
+            lines.extend(entry_lines[:count - len(lines)])
+            if len(lines) == count:
+                break
+        return lines
 
 
 def closest_monster(max_range):
@@ -309,6 +954,7 @@ def monster_death(monster):
     monster.AI = None
     monster.name = 'remains of ' + monster.name
     monster.send_to_back()
+    scheduler.remove(monster)
 
 
 class Fighter:
@@ -347,6 +993,7 @@ class Fighter:
             message(self.owner.name.capitalize() + ' attacks ' + target.name + ' for ' + str(damage) + ' hit points.',
                     color=libtcod.orange)
             target.fighter.take_damage(damage)
+            make_noise(target.x, target.y, COMBAT_NOISE_RADIUS)
         else:
             message(self.owner.name.capitalize() + ' attacks ' + target.name + ' for no damage!',
                     color=libtcod.darker_yellow)
@@ -354,17 +1001,35 @@ class Fighter:
 
 class BasicMonster:
     # AI for a basic monster:
+    def __init__(self):
+        # where it last heard a noise, while it is on its way to see what it was
+        self.noise = None
+
     def take_turn(self):
         # a basic monster takes its turn. If you can see it, it will chase
         monster = self.owner
-        if libtcod.map_is_in_fov(fov_map, monster.x, monster.y):
+        if visible_tiles[monster.x, monster.y]:
+            self.noise = None
 
-            # move towards player if far away
+            # move towards player if far away, along the way every monster chasing the player shares
             # close enough, attack! (if the player is still alive.)
             if monster.distance_to_object(player) >= 2:
-                monster.move_towards(player.x, player.y)
+                player_field.update(tile_map, player.x, player.y)
+                step = player_field.step(monster.x, monster.y)
+                if step is not None:
+                    monster.move(*step)
             elif player.fighter.hp > 0:
                 monster.fighter.attack(player)
+        elif self.noise is not None and (monster.x, monster.y) != self.noise:
+            # go and see what the noise was, unless something is in the way
+            old_position = (monster.x, monster.y)
+            monster.move_astar(*self.noise)
+            if (monster.x, monster.y) == old_position:
+                self.noise = None
+        else:
+            # nothing to do until the player comes into view or makes a noise
+            self.noise = None
+            scheduler.sleep(monster)
 
 
 class ConfusedMonster:
@@ -376,24 +1041,104 @@ class ConfusedMonster:
     def take_turn(self):
         if self.num_turns > 0:
             # move in a random direction
-            self.owner.move(libtcod.random_get_int(0, -1, 1), libtcod.random_get_int(0, -1, 1))
+            self.owner.move(*libtcod.random_get_ints(rngs['ai'], -1, 1, 2))
             self.num_turns -= 1
         else:
             self.owner.AI = self.old_AI
             message('The ' + self.owner.name + ' is no longer confused.', libtcod.darker_yellow)
 
 
-class Object:
+class TurnScheduler:
+    # decides whose turn it is. actors (objects with an AI) wait in a priority queue ordered by the time of their next
+    # turn, and every turn an actor takes puts its next one ACTION_COST later, scaled by its speed. a sleeping actor is
+    # out of the queue altogether and costs nothing until it is woken up.
+    def __init__(self, width, height):
+        self.time = 0
+        # (time of the turn, order it was scheduled in, actor)
+        self.queue = []
+        # actor -> order of its live queue entry. entries of actors that were since rescheduled, put to sleep or
+        # removed stay in the queue, and are skipped when they come up.
+        self.entries = {}
+        self.sleeping = set()
+        # the tiles sleeping actors are on (they don't move in their sleep), so waking up every actor in an area is a
+        # single array operation whatever the number of sleepers
+        self.asleep_at = numpy.zeros((width, height), dtype=bool)
+        self.counter = itertools.count()
+
+    def turn_length(self, actor):
+        return max(1, ACTION_COST * NORMAL_SPEED / actor.speed)
+
+    def add(self, actor, delay=None):
+        # give actor a turn delay from now, by default one of its turns from now
+        if delay is None:
+            delay = self.turn_length(actor)
+        order = next(self.counter)
+        self.entries[actor] = order
+        heapq.heappush(self.queue, (self.time + delay, order, actor))
+
+    def remove(self, actor):
+        self.entries.pop(actor, None)
+        if actor in self.sleeping:
+            self.sleeping.remove(actor)
+            self.asleep_at[actor.x, actor.y] = False
+
+    def sleep(self, actor):
+        if self.entries.pop(actor, None) is not None:
+            self.sleeping.add(actor)
+            self.asleep_at[actor.x, actor.y] = True
+
+    def wake(self, actor):
+        if actor in self.sleeping:
+            self.sleeping.remove(actor)
+            self.asleep_at[actor.x, actor.y] = False
+            self.add(actor)
+
+    def wake_where(self, mask, x=0, y=0):
+        # wake up the actors sleeping on the tiles set in mask, a boolean [x, y] array covering the part of the map
+        # starting at (x, y). returns the actors woken up.
+        width, height = mask.shape
+        xs, ys = numpy.nonzero(mask & self.asleep_at[x:x + width, y:y + height])
+        woken = []
+        for tile_x, tile_y in zip((xs + x).tolist(), (ys + y).tolist()):
+            for actor in objects.at(tile_x, tile_y):
+                if actor in self.sleeping:
+                    self.wake(actor)
+                    woken.append(actor)
+        return woken
+
+    def run(self, until):
+        # let every actor whose turn comes up by time until take it
+        while self.queue and self.queue[0][0] <= until:
+            time, order, actor = heapq.heappop(self.queue)
+            if self.entries.get(actor) != order:
+                continue
+            if actor.AI is None or actor.container is not objects:
+                # it died or is gone from the level
+                del self.entries[actor]
+                continue
+            self.time = time
+            actor.AI.take_turn()
+            if self.entries.get(actor) == order:
+                # still awake
+                self.add(actor)
+        self.time = until
+
+
+class Object(object):
     # this is a generic object: the player, a monster, an item, the stairs...
     # it's always represented by a character on screen.
-    def __init__(self, x, y, char, name, color, blocks=False, always_visible=False, fighter=None, AI=None, item=None):
-        self.x = x
-        self.y = y
+    def __init__(self, x, y, char, name, color, blocks=False, always_visible=False, fighter=None, AI=None, item=None,
+                 speed=NORMAL_SPEED):
+        # the ObjectList this object is on, if any. it is told about every change of position.
+        self.container = None
+        self._x = x
+        self._y = y
         self.char = char
         self.name = name
         self.color = color
         self.blocks = blocks
         self.always_visible = always_visible
+        self.speed = speed
 
         self.fighter = fighter
         if self.fighter:
@@ -407,6 +1152,31 @@ class Object:
         if self.item:
             self.item.owner = self
 
+        # (depth, index) for an object that was put on a level as it was generated (see generate_level)
+        self.origin = None
+
+    @property
+    def x(self):
+        return self._x
+
+    @x.setter
+    def x(self, value):
+        old_x = self._x
+        self._x = value
+        if self.container is not None:
+            self.container.moved(self, old_x, self._y)
+
+    @property
+    def y(self):
+        return self._y
+
+    @y.setter
+    def y(self, value):
+        old_y = self._y
+        self._y = value
+        if self.container is not None:
+            self.container.moved(self, self._x, old_y)
+
     def move(self, dx, dy):
         if (in_map(self.x + dx, self.y + dy)) and (not is_blocked(self.x + dx, self.y + dy)):
             # move by the given amount
@@ -435,6 +1205,15 @@ class Object:
         dy = int(round(dy / distance))
         self.move(dx, dy)
 
+    def move_astar(self, target_x, target_y):
+        # take the next step on the shortest way to (target_x, target_y). if something is standing in the way, or
+        # there is no way there, just head straight for it.
+        step = path_service.next_step(tile_map, self.x, self.y, target_x, target_y)
+        if step is not None and not is_blocked(*step):
+            self.x, self.y = step
+        else:
+            self.move_towards(target_x, target_y)
+
     def draw(self):
         # set the color and then
         libtcod.console_set_default_foreground(con, self.color)
@@ -451,35 +1230,363 @@ class Object:
         objects.insert(0, self)
 
 
-def save_game():
-    # open a new empty shelve (possibly overwriting an old one)
-    file = shelve.open('savegame', 'n')
-    file['tile_map'] = tile_map
-    file['objects'] = objects
-    file['player_index'] = objects.index(player)
-    file['current_depth'] = current_depth
-    file['inventory'] = inventory
-    file['messages'] = messages
-    file['game_state'] = game_state
-    file.close()
-
-
-def load_game():
-    # open the previously saved shelve and load the game data
-    global tile_map, objects, player, inventory, messages, game_state, current_depth
-
-    file = shelve.open('savegame', 'r')
-    current_depth = file['current_depth']
-    tile_map = file['tile_map']
-    objects = file['objects']
-    player = objects[file['player_index']]
-    inventory = file['inventory']
-    messages = file['messages']
-    game_state = file['game_state']
-    file.close()
+class ObjectList(list):
+    # the objects on the current level, in drawing order. it also keeps track of which objects are on each tile, so
+    # "what is at (x, y)" doesn't have to scan the whole list. objects tell the list they are on whenever they move.
+    def __init__(self, objects=()):
+        list.__init__(self)
+        self.tiles = {}
+        for obj in objects:
+            self.append(obj)
+
+    def append(self, obj):
+        list.append(self, obj)
+        self._place(obj, on_top=True)
+
+    def extend(self, objects):
+        for obj in objects:
+            self.append(obj)
+
+    def insert(self, index, obj):
+        list.insert(self, index, obj)
+        self._place(obj, on_top=index != 0)
+
+    def remove(self, obj):
+        list.remove(self, obj)
+        self._lift(obj, obj.x, obj.y)
+        obj.container = None
+
+    def moved(self, obj, old_x, old_y):
+        # called by an object on this list after its position changed
+        self._lift(obj, old_x, old_y)
+        self._place(obj, on_top=True)
+
+    def at(self, x, y):
+        # the objects on the tile at (x, y), bottom-most first
+        return self.tiles.get((x, y), ())
+
+    def blocking_at(self, x, y):
+        # the object blocking the tile at (x, y), or None
+        for obj in self.at(x, y):
+            if obj.blocks:
+                return obj
+        return None
+
+    def _place(self, obj, on_top):
+        obj.container = self
+        on_tile = self.tiles.setdefault((obj.x, obj.y), [])
+        if on_top:
+            on_tile.append(obj)
+        else:
+            on_tile.insert(0, obj)
+
+    def _lift(self, obj, x, y):
+        on_tile = self.tiles[(x, y)]
+        on_tile.remove(obj)
+        if not on_tile:
+            del self.tiles[(x, y)]
+
+
+def save_game(filename='savegame'):
+    # write a new save file (possibly overwriting an old one)
+    with open(filename, 'wb') as f:
+        write_save(f)
+
+
+def load_game(filename='savegame'):
+    # load the game data from a save file
+    global tile_map, objects, player, inventory, messages, game_state, current_depth, game_seed
+
+    level_store.clear()
+    with open(filename, 'rb') as f:
+        for tag, payload in read_save_sections(f):
+            if tag == 'GAME':
+                current_depth, player_index, game_seed, game_state = decode_game(payload)
+            elif tag == 'HERE':
+                depth, tile_map, objects, player_x, player_y = decode_level(payload)
+            elif tag == 'LEVL':
+                level_store.put_record(LEVEL_RECORD.unpack_from(payload)[0], payload)
+            elif tag == 'INVT':
+                inventory, offset = decode_entities(payload)
+            elif tag == 'MSGS':
+                messages = decode_messages(payload)
+    player = objects[player_index]
+    # the combat and AI generators' states aren't saved, they just start over
+    seed_streams(('combat', 'ai'), game_seed, current_depth)
+    schedule_actors()
 
     initialize_fov()
 
+
+##############
+# SAVE FILES #
+##############
+
+# a save file is a header followed by sections, each one a 4 character tag, the length of its payload and then the
+# payload itself:
+#   GAME  the current depth, the player's index in the current level's objects, the game's seed and the game state
+#   HERE  the current level, a level record (see encode_level)
+#   LEVL  a level the player has left, also a level record. there is one for each level in the level store.
+#   INVT  the inventory, as a count and then an entity record for each item (see encode_entity)
+#   MSGS  the message log, as a count and then a message record for each message (see encode_messages)
+# all numbers are little-endian. readers skip sections they don't know.
+SAVE_MAGIC = 'FRLS'
+SAVE_FORMAT_VERSION = 5
+SAVE_HEADER = struct.Struct('<4sH')
+SECTION_HEADER = struct.Struct('<4sI')
+
+GAME_RECORD = struct.Struct('<iII')
+# depth, player x, player y, width, height, then what changed since the level was generated (see encode_level)
+LEVEL_RECORD = struct.Struct('<ihhHH')
+COUNT = struct.Struct('<I')
+# the index of an object among those of its level as generated
+ORIGIN_INDEX = struct.Struct('<H')
+# x, y, char, color (r, g, b), flags, speed, followed by the name and then one record for each component it has
+ENTITY_RECORD = struct.Struct('<hhB3BBH')
+ENTITY_BLOCKS = 1
+ENTITY_ALWAYS_VISIBLE = 2
+ENTITY_FIGHTER = 4
+ENTITY_AI = 8
+ENTITY_ITEM = 16
+# max hp, hp, defense, power, death function
+FIGHTER_RECORD = struct.Struct('<hhhhB')
+# AI class, turns left. an entity's AI is saved as a count and then one of these per layer: a confused monster has
+# its own AI followed by the one it goes back to.
+AI_RECORD = struct.Struct('<Bh')
+# use function, quantity
+ITEM_RECORD = struct.Struct('<BH')
+# color (r, g, b), followed by the text
+MESSAGE_RECORD = struct.Struct('<3BH')
+STRING_LENGTH = struct.Struct('<H')
+
+# the functions and AI classes a record can refer to, by their index in these lists. only ever add to the end of
+# them, or older saves will load the wrong ones.
+saved_death_functions = [None, 'player_death', 'monster_death']
+saved_use_functions = [None, 'cast_heal', 'cast_lightning', 'cast_confuse', 'cast_fireball', 'cast_magic_map',
+                       'cast_phase_door']
+saved_AI_classes = [None, 'BasicMonster', 'ConfusedMonster']
+
+
+def function_index(names, function):
+    return names.index(function.__name__ if function is not None else None)
+
+
+def named_function(names, index):
+    return globals()[names[index]] if names[index] is not None else None
+
+
+def encode_string(text):
+    return STRING_LENGTH.pack(len(text)) + text
+
+
+def decode_string(data, offset):
+    (length,) = STRING_LENGTH.unpack_from(data, offset)
+    offset += STRING_LENGTH.size
+    return data[offset:offset + length], offset + length
+
+
+def encode_entity(obj):
+    flags = ((ENTITY_BLOCKS if obj.blocks else 0) | (ENTITY_ALWAYS_VISIBLE if obj.always_visible else 0) |
+             (ENTITY_FIGHTER if obj.fighter else 0) | (ENTITY_AI if obj.AI else 0) | (ENTITY_ITEM if obj.item else 0))
+    parts = [ENTITY_RECORD.pack(obj.x, obj.y, ord(obj.char), obj.color.r, obj.color.g, obj.color.b, flags, obj.speed),
+             encode_string(obj.name)]
+    if obj.fighter:
+        fighter = obj.fighter
+        parts.append(FIGHTER_RECORD.pack(fighter.max_hp, fighter.hp, fighter.defense, fighter.power,
+                                         function_index(saved_death_functions, fighter.death_function)))
+    if obj.AI:
+        layers = []
+        AI = obj.AI
+        while AI is not None:
+            layers.append(AI_RECORD.pack(saved_AI_classes.index(AI.__class__.__name__), getattr(AI, 'num_turns', 0)))
+            AI = getattr(AI, 'old_AI', None)
+        parts.append(COUNT.pack(len(layers)) + ''.join(layers))
+    if obj.item:
+        parts.append(ITEM_RECORD.pack(function_index(saved_use_functions, obj.item.use_function), obj.item.quantity))
+    return ''.join(parts)
+
+
+def decode_entity(data, offset):
+    # an Object from its entity record, starting at offset in data. returns it and the offset after the record.
+    x, y, char, r, g, b, flags, speed = ENTITY_RECORD.unpack_from(data, offset)
+    offset += ENTITY_RECORD.size
+    name, offset = decode_string(data, offset)
+
+    fighter_component = None
+    if flags & ENTITY_FIGHTER:
+        max_hp, hp, defense, power, death_function = FIGHTER_RECORD.unpack_from(data, offset)
+        offset += FIGHTER_RECORD.size
+        fighter_component = Fighter(hp=max_hp, defense=defense, power=power,
+                                    death_function=named_function(saved_death_functions, death_function))
+        fighter_component.hp = hp
+
+    layers = []
+    if flags & ENTITY_AI:
+        (num_layers,) = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+        for i in xrange(num_layers):
+            layers.append(AI_RECORD.unpack_from(data, offset))
+            offset += AI_RECORD.size
+    # build the AI from the innermost layer out
+    ai_component = None
+    for AI_class, num_turns in reversed(layers):
+        AI_class = globals()[saved_AI_classes[AI_class]]
+        if AI_class is ConfusedMonster:
+            ai_component = ConfusedMonster(ai_component, num_turns)
+        else:
+            ai_component = AI_class()
+
+    item_component = None
+    if flags & ENTITY_ITEM:
+        use_function, quantity = ITEM_RECORD.unpack_from(data, offset)
+        offset += ITEM_RECORD.size
+        item_component = Item(named_function(saved_use_functions, use_function), quantity)
+
+    obj = Object(x, y, chr(char), name, libtcod.Color(r, g, b), blocks=bool(flags & ENTITY_BLOCKS),
+                 always_visible=bool(flags & ENTITY_ALWAYS_VISIBLE), fighter=fighter_component, AI=ai_component,
+                 item=item_component, speed=speed)
+    # the AIs a confused monster goes back to belong to it as well
+    AI = ai_component
+    while AI is not None:
+        AI.owner = obj
+        AI = getattr(AI, 'old_AI', None)
+    return obj, offset
+
+
+def encode_entities(objs):
+    return COUNT.pack(len(objs)) + ''.join(encode_entity(obj) for obj in objs)
+
+
+def decode_entities(data, offset=0):
+    (count,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    objs = []
+    for i in xrange(count):
+        obj, offset = decode_entity(data, offset)
+        objs.append(obj)
+    return objs, offset
+
+
+def encode_level(depth, tile_map, objects, player_x, player_y):
+    # levels come out the same every time they are generated (see generate_level), so a level record only holds what
+    # changed since: the explored tiles, then the order of the objects on the level, each one given as the index of a
+    # generated object or, counting on from the last of those, of an object that wasn't generated. then come the
+    # generated objects that changed, as their index and entity record, and the objects that weren't generated.
+    # generated objects missing from the order (killed, picked up...) are gone.
+    baseline = level_store.baseline(depth)
+    generated = {}
+    for obj in objects:
+        if obj.origin is not None and obj.origin[0] == depth and obj.origin[1] < len(baseline):
+            generated.setdefault(obj.origin[1], obj)
+    added = []
+    order = []
+    for obj in objects:
+        if obj.origin is not None and generated.get(obj.origin[1]) is obj:
+            order.append(obj.origin[1])
+        else:
+            order.append(len(baseline) + len(added))
+            added.append(obj)
+    changed = []
+    for index, obj in sorted(generated.items()):
+        record = encode_entity(obj)
+        if record != baseline[index]:
+            changed.append(ORIGIN_INDEX.pack(index) + record)
+    return (LEVEL_RECORD.pack(depth, player_x, player_y, tile_map.width, tile_map.height) +
+            tile_map.pack_explored() +
+            COUNT.pack(len(order)) + ''.join(ORIGIN_INDEX.pack(index) for index in order) +
+            COUNT.pack(len(changed)) + ''.join(changed) + encode_entities(added))
+
+
+def decode_level(data):
+    # returns the depth, TileMap, ObjectList and player position of a level record, generating the level again
+    depth, player_x, player_y, width, height = LEVEL_RECORD.unpack_from(data)
+    tile_map, generated, start_x, start_y, baseline = generate_level(depth)
+    if (tile_map.width, tile_map.height) != (width, height):
+        raise ValueError('level record for a %dx%d map, not %dx%d' % (width, height, tile_map.width, tile_map.height))
+    level_store.baselines[depth] = baseline
+
+    offset = tile_map.unpack_explored(data, LEVEL_RECORD.size)
+    (count,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    order = struct.unpack_from('<%dH' % count, data, offset)
+    offset += ORIGIN_INDEX.size * count
+
+    generated = list(generated)
+    (count,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    for i in xrange(count):
+        (index,) = ORIGIN_INDEX.unpack_from(data, offset)
+        obj, offset = decode_entity(data, offset + ORIGIN_INDEX.size)
+        obj.origin = (depth, index)
+        generated[index] = obj
+    added, offset = decode_entities(data, offset)
+    objs = generated + added
+    return depth, tile_map, ObjectList(objs[index] for index in order), player_x, player_y
+
+
+def decode_game(data):
+    current_depth, player_index, seed = GAME_RECORD.unpack_from(data)
+    game_state, offset = decode_string(data, GAME_RECORD.size)
+    return current_depth, player_index, seed, game_state
+
+
+def encode_messages(log):
+    # a message record is its color and how many times in a row it came up, then its text
+    return COUNT.pack(len(log)) + ''.join(MESSAGE_RECORD.pack(color.r, color.g, color.b, count) + encode_string(text)
+                                          for text, color, count in log)
+
+
+def decode_messages(data):
+    (count,) = COUNT.unpack_from(data)
+    offset = COUNT.size
+    log = MessageLog(MESSAGE_LOG_SIZE)
+    for i in xrange(count):
+        r, g, b, repeats = MESSAGE_RECORD.unpack_from(data, offset)
+        text, offset = decode_string(data, offset + MESSAGE_RECORD.size)
+        log.add(text, libtcod.Color(r, g, b), repeats)
+    return log
+
+
+def write_section(f, tag, payload):
+    f.write(SECTION_HEADER.pack(tag, len(payload)))
+    f.write(payload)
+
+
+def write_save(f):
+    f.write(SAVE_HEADER.pack(SAVE_MAGIC, SAVE_FORMAT_VERSION))
+    write_section(f, 'GAME',
+                  GAME_RECORD.pack(current_depth, objects.index(player), game_seed) + encode_string(game_state))
+    write_section(f, 'HERE', encode_level(current_depth, tile_map, objects, player.x, player.y))
+    for record in level_store.records():
+        write_section(f, 'LEVL', record)
+    write_section(f, 'INVT', encode_entities(inventory))
+    write_section(f, 'MSGS', encode_messages(messages))
+
+
+def read_save_sections(f):
+    # read a save file one section at a time, yielding (tag, payload) pairs. only one section is held in memory at a
+    # time, so a caller that only wants (say) the GAME section can stop early.
+    header = f.read(SAVE_HEADER.size)
+    if len(header) != SAVE_HEADER.size:
+        raise ValueError('not a save file')
+    magic, version = SAVE_HEADER.unpack(header)
+    if magic != SAVE_MAGIC:
+        raise ValueError('not a save file')
+    if version != SAVE_FORMAT_VERSION:
+        raise ValueError('unsupported save file version ' + str(version))
+    while True:
+        section_header = f.read(SECTION_HEADER.size)
+        if not section_header:
+            return
+        if len(section_header) != SECTION_HEADER.size:
+            raise ValueError('truncated save file')
+        tag, length = SECTION_HEADER.unpack(section_header)
+        payload = f.read(length)
+        if len(payload) != length:
+            raise ValueError('truncated save file')
+        yield tag, payload
+
+
 # monster_spawn_stats = { 'monster-name': {depth: chance-of-spawning-at-depth,   #0 < chance-of-spawning-at-depth <= 100
 # depth2: chance-of-spawning-at-depth2, ... }
 monster_spawn_stats = {
@@ -504,50 +1611,68 @@ item_spawn_stats = {
 
 def depth_chances(depth, game_objects):
     # pull out all the objects with non-zero probabilities of spawning at depth and put them in a dictionary
-    # together with their probability of appearing at depth
+    # together with their chance of appearing at depth
     object_chances = {game_object: game_objects[game_object][depth] for game_object in game_objects if
                       depth in game_objects[game_object]}
-    # scale the probabilities so that their relative size is the same and their weighted sum is close to 100
-    weight = sum(object_chances.values())
-    for game_object in object_chances:
-        object_chances[game_object] = round((float(object_chances[game_object]) / weight) * 100)
-
+    if len(object_chances) == 0:
+        raise RuntimeError('nothing can spawn at depth ' + str(depth))
     return object_chances
 
 
-def random_choice(depth, game_objects):
-    objects_chances_dict = depth_chances(depth, game_objects)
-    choices = objects_chances_dict.keys()
-    chances = objects_chances_dict.values()
-    print 'Objects_chances_dict =', objects_chances_dict
-    if len(choices) == 0 or len(chances) == 0:
-        raise RuntimeError('object_chances_dict had an empty value or keys set ')
+class AliasSampler:
+    # picks one of a fixed set of choices at random, weighted by their chances, in constant time (Vose's alias
+    # method). building it is linear in the number of choices, so it is built once and reused.
+    def __init__(self, chances):
+        self.choices = sorted(chances)
+        n = len(self.choices)
+        total = float(sum(chances.values()))
+
+        # scale the chances so that they average 1, then pair every choice below 1 with one above 1 which takes up
+        # the rest of its slot
+        scaled = [chances[choice] * n / total for choice in self.choices]
+        self.probability = [1.0] * n
+        self.alias = range(n)
+        small = [i for i in xrange(n) if scaled[i] < 1.0]
+        large = [i for i in xrange(n) if scaled[i] >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
 
-    if len(choices) != len(chances):
-        raise RuntimeError('random choice needs a dictionary with a 1-to-1 key: value relationship')
+    def sample(self, rng=0):
+        index = libtcod.random_get_int(rng, 0, len(self.choices) - 1)
+        if libtcod.random_get_float(rng, 0.0, 1.0) < self.probability[index]:
+            return self.choices[index]
+        return self.choices[self.alias[index]]
 
-    running_total_chance = 0
 
-    dice_roll = libtcod.random_get_int(0, 0, 100)
-    print 'Dice_roll =', dice_roll
-    for index, chance in enumerate(chances):
-        running_total_chance += chance
-        if dice_roll <= running_total_chance:
-            print 'choices[index] =', choices[index], 'index =', index
-            return choices[index]
+# samplers built so far, by (spawn table, depth). the spawn tables never change so they can be cached forever.
+spawn_samplers = {}
 
 
-def place_objects(room):
+def random_choice(depth, game_objects):
+    key = (id(game_objects), depth)
+    if key not in spawn_samplers:
+        spawn_samplers[key] = AliasSampler(depth_chances(depth, game_objects))
+    return spawn_samplers[key].sample(rngs['spawn'])
+
+
+def place_objects(room, depth):
     # choose random number of monsters
-    num_monsters = libtcod.random_get_int(0, 0, MAX_ROOM_MONSTERS)
+    num_monsters = libtcod.random_get_int(rngs['spawn'], 0, MAX_ROOM_MONSTERS)
 
     for i in xrange(num_monsters):
         # choose random spot for this monster within the given room
-        x = libtcod.random_get_int(0, room.x1 + 1, room.x2 - 1)
-        y = libtcod.random_get_int(0, room.y1 + 1, room.y2 - 1)
+        x = libtcod.random_get_int(rngs['spawn'], room.x1 + 1, room.x2 - 1)
+        y = libtcod.random_get_int(rngs['spawn'], room.y1 + 1, room.y2 - 1)
 
         if not is_blocked(x, y):
-            monster_name = random_choice(current_depth, monster_spawn_stats)
+            monster_name = random_choice(depth, monster_spawn_stats)
             if monster_name == 'orc':
                 fighter_component = Fighter(hp=10, defense=0, power=3, death_function=monster_death)
                 ai_component = BasicMonster()
@@ -560,19 +1685,19 @@ def place_objects(room):
                                  AI=ai_component)
             objects.append(monster)
 
-    place_items(room)
+    place_items(room, depth)
 
 
-def place_items(room):
+def place_items(room, depth):
     # choose random number of items
-    num_items = libtcod.random_get_int(0, 0, MAX_ROOM_ITEMS)
+    num_items = libtcod.random_get_int(rngs['spawn'], 0, MAX_ROOM_ITEMS)
 
     for i in xrange(num_items):
         # choose random spot for this monster within the given room
-        x = libtcod.random_get_int(0, room.x1 + 1, room.x2 - 1)
-        y = libtcod.random_get_int(0, room.y1 + 1, room.y2 - 1)
+        x = libtcod.random_get_int(rngs['spawn'], room.x1 + 1, room.x2 - 1)
+        y = libtcod.random_get_int(rngs['spawn'], room.y1 + 1, room.y2 - 1)
         if not is_blocked(x, y):
-            item_name = random_choice(current_depth, item_spawn_stats)
+            item_name = random_choice(depth, item_spawn_stats)
             item_component = Item(items[item_name]['use_function'])
             item = Object(x, y, items[item_name]['char'], item_name, always_visible=True,
                           color=items[item_name]['color'], item=item_component)
@@ -622,8 +1747,8 @@ class Item:
 
         same_item_on_tile_already = False
 
-        for object in objects:
-            if object.item and self.owner.distance_to_object(object) == 0 and self.owner.name == object.name:
+        for object in objects.at(player.x, player.y):
+            if object.item and self.owner.name == object.name:
                 object.item.quantity += self.quantity
                 same_item_on_tile_already = True
         if not same_item_on_tile_already:
@@ -653,6 +1778,7 @@ def cast_lightning():
     message('A lightning bolt strikes the ' + monster.name + ' with a loud thunder! The damage is ' + str(
         LIGHTNING_DAMAGE) + ' hit points.', color=libtcod.lightest_red)
     monster.fighter.take_damage(LIGHTNING_DAMAGE)
+    make_noise(monster.x, monster.y, THUNDER_NOISE_RADIUS)
 
 
 def cast_confuse():
@@ -669,6 +1795,7 @@ def cast_confuse():
 
 
 def cast_fireball():
+    global fov_recompute
     # ask the player for a target tile to throw a fireball at
     message('Left-click a target tile for the fireball. Escape or right-click to cancel targeting.', color=libtcod.cyan)
 
@@ -677,6 +1804,9 @@ def cast_fireball():
         return 'cancelled'
 
     message('The fireball explodes, burning everything within a ' + str(FIREBALL_RADIUS) + ' tile radius!')
+    make_noise(x, y, EXPLOSION_NOISE_RADIUS)
+    lighting.flash(x, y, FIREBALL_FLASH_RADIUS, libtcod.flame)
+    fov_recompute = True
 
     for obj in objects:
         if obj.distance_to_tile(x, y) < FIREBALL_RADIUS and obj.fighter:
@@ -689,23 +1819,14 @@ def cast_magic_map():
     global fov_recompute
     # magic mapping marks the map as revealed, as if you had been to all the squares before.
     message("Your mind's eye opens wide, and the surroundings feel somehow familiar to you.", color=libtcod.white)
-    libtcod.map_compute_fov(fov_map, player.x, player.y, 9999, FOV_LIGHT_WALLS, FOV_ALGO)
-    for y in xrange(MAP_HEIGHT):
-        for x in xrange(MAP_WIDTH):
-            if libtcod.map_is_walkable(fov_map, x, y):
-                # flagging adjacent tiles so that the walls are also visible
-                tile_map[x - 1][y - 1].explored = True
-                tile_map[x - 1][y].explored = True
-                tile_map[x - 1][y + 1].explored = True
-                tile_map[x][y - 1].explored = True
-                tile_map[x][y].explored = True
-                tile_map[x][y + 1].explored = True
-                tile_map[x + 1][y - 1].explored = True
-                tile_map[x + 1][y].explored = True
-                tile_map[x + 1][y + 1].explored = True
+    # flag every open tile, and the tiles adjacent to them so that the walls are also visible
+    tile_map.explored |= dilate(~tile_map.blocked)
     fov_recompute = True
-    draw_map_panel()
-    libtcod.console_flush()
+    # that's well beyond the part of the map fov changes, so have it all looked at
+    map_renderer.invalidate()
+    if not headless:
+        draw_map_panel()
+        libtcod.console_flush()
 
 
 def cast_phase_door():
@@ -716,11 +1837,11 @@ def cast_phase_door():
     searching_for_destination = True
     while searching_for_destination:
         # choose dx, dy so that their sum is PHASE_DOOR_DISTANCE
-        dx = libtcod.random_get_int(0, 0, PHASE_DOOR_DISTANCE)
+        dx = libtcod.random_get_int(rngs['combat'], 0, PHASE_DOOR_DISTANCE)
         dy = PHASE_DOOR_DISTANCE - dx
         # apply random + / - to dx , dy after determining their magnitude
-        dx *= plus_or_minus_one()
-        dy *= plus_or_minus_one()
+        dx *= plus_or_minus_one(rngs['combat'])
+        dy *= plus_or_minus_one(rngs['combat'])
         if not is_blocked(player.x + dx, player.y + dy):
             player_move_or_attack(dx, dy)
             searching_for_destination = False
@@ -740,32 +1861,14 @@ items = {
                              'use_function': cast_phase_door}}
 
 
-def place_stairs(rooms):
-    num_upstairs = 0
-    num_downstairs = 0
-    downstairs = libtcod.random_get_int(0, MIN_DOWNSTAIRS, MAX_DOWNSTAIRS)
-    upstairs = libtcod.random_get_int(0, MIN_UPSTAIRS, MAX_UPSTAIRS)
-    while num_downstairs < downstairs or num_upstairs < upstairs:
-        random_index = libtcod.random_get_int(0, 0, len(rooms) - 1)
-        room = rooms[random_index]
-        x = libtcod.random_get_int(0, room.x1 + 1, room.x2 - 1)
-        y = libtcod.random_get_int(0, room.y1 + 1, room.y2 - 1)
-        if (not is_blocked(x, y)) and (libtcod.console_get_char(con, x, y) not in ('<', '>')):
-            dice = libtcod.random_get_int(0, 0, 100)
-            if dice < 50 and num_upstairs < upstairs:
-                stair = Object(x, y, '<', 'stairs', always_visible=True, color=libtcod.white)
-                objects.append(stair)
-                stair.send_to_back()
-                num_upstairs += 1
-            elif num_downstairs < downstairs:
-                stair = Object(x, y, '>', 'stairs', always_visible=True, color=libtcod.white)
-                objects.append(stair)
-                stair.send_to_back()
-                num_downstairs += 1
-
+def new_game(seed=None):
+    global player, inventory, messages, game_state, player_action, current_depth, game_seed
 
-def new_game():
-    global player, inventory, messages, game_state, player_action, current_depth
+    # everything random in the game follows from this
+    if seed is None:
+        seed = libtcod.random_get_int(0, 0, 0x7fffffff)
+    game_seed = seed
+    seed_streams(('combat', 'ai'), game_seed)
 
     # create the player Object
     fighter_component = Fighter(hp=30, defense=2, power=5, death_function=player_death)
@@ -773,6 +1876,7 @@ def new_game():
                     fighter=fighter_component)
 
     current_depth = 0
+    level_store.clear()
 
     # generate map without (yet) drawing it to screen
     make_map()
@@ -785,7 +1889,7 @@ def new_game():
     inventory = []
 
     # welcome message
-    messages = []
+    messages = MessageLog(MESSAGE_LOG_SIZE)
     message('Welcome back to <game>, player ' + player.name + '! Prepare to die!')
 
 
@@ -801,10 +1905,10 @@ def player_move_or_attack(dx, dy):
     x = player.x + dx
     y = player.y + dy
 
-    # find an attackable object at (x, y)
+    # find an attackable object at (x, y), which isn't the player when they are waiting
     target = None
-    for object in objects:
-        if (object.x, object.y) == (x, y) and object.fighter:
+    for object in objects.at(x, y):
+        if object.fighter and object is not player:
             target = object
             break
 
@@ -825,8 +1929,8 @@ player_wait_one_turn = partial(player_move_or_attack, 0, 0)
 
 
 def pickup_item():
-    for object in reversed(objects):
-        if (player.x, player.y) == (object.x, object.y) and object.item:
+    for object in reversed(objects.at(player.x, player.y)):
+        if object.item:
             object.item.pick_up()
             break
 
@@ -847,24 +1951,26 @@ def view_inventory():
 
 def use_stairs_up():
     # go upstairs
-    for object in objects:
-        if (player.x, player.y) == (object.x, object.y) and object.name == 'stairs' and object.char == '<':
-            change_depth(1)
+    for object in objects.at(player.x, player.y):
+        if object.name == 'stairs' and object.char == '<':
+            if change_depth(1):
+                # leave a way back down on a new level
+                return_stairs = Object(player.x, player.y, '>', 'stairs', always_visible=True, color=libtcod.white)
+                objects.append(return_stairs)
+                return_stairs.send_to_back()
             break
-    return_stairs = Object(player.x, player.y, '>', 'stairs', always_visible=True, color=libtcod.white)
-    objects.append(return_stairs)
-    return_stairs.send_to_back()
 
 
 def use_stairs_down():
     # go downstairs
-    for object in objects:
-        if (player.x, player.y) == (object.x, object.y) and object.name == 'stairs' and object.char == '>':
-            change_depth(-1)
+    for object in objects.at(player.x, player.y):
+        if object.name == 'stairs' and object.char == '>':
+            if change_depth(-1):
+                # leave a way back up on a new level
+                return_stairs = Object(player.x, player.y, '<', 'stairs', always_visible=True, color=libtcod.white)
+                objects.append(return_stairs)
+                return_stairs.send_to_back()
             break
-    return_stairs = Object(player.x, player.y, '<', 'stairs', always_visible=True, color=libtcod.white)
-    objects.append(return_stairs)
-    return_stairs.send_to_back()
 
 
 def handle_keys():
@@ -908,52 +2014,260 @@ def handle_keys():
 # END OF KEYBOARD HANDLING
 ###########
 
-def draw_all():
-    draw_map_panel()
-    draw_messages_panel()
-    draw_stat_panel()
+class RenderScheduler:
+    # draws the panels whose contents could have changed since they were last drawn, and leaves the screen alone if
+    # none could have. every panel comes with a function giving a key that changes whenever what it shows does.
+    def __init__(self):
+        self.panels = [('map', map_panel_key, render_map_panel),
+                       ('messages', messages_panel_key, render_messages_panel),
+                       ('stats', stat_panel_key, render_stat_panel)]
+        self.keys = {}
+
+    def invalidate(self):
+        # draw everything next time, for when something else was drawn over the screen
+        self.keys.clear()
+
+    def render(self):
+        # returns whether anything was drawn
+        drawn = []
+        for name, panel_key, render_panel in self.panels:
+            if name not in self.keys or self.keys[name] != panel_key():
+                render_panel()
+                # the key as of after drawing, which may have dealt with some of what was pending
+                self.keys[name] = panel_key()
+                drawn.append(name)
+        if not drawn:
+            return False
+
+        # the highlight goes on top of the map panel as it is on screen, so it can only be redrawn along with it
+        if 'map' in drawn:
+            draw_target_tile_highlighter()
+        libtcod.console_flush()
+        return True
 
+
+def map_panel_key():
+    # fov_recompute covers everything that changes the map itself (and drawing the panel resets it)
+    return (fov_recompute, tuple((object.x, object.y, object.char) for object in objects),
+            mouse.cx, mouse.cy)
+
+
+def messages_panel_key():
+    return messages.version
+
+
+def stat_panel_key():
+    return (player.x, player.y, player.fighter.defense, player.fighter.power, player.fighter.hp,
+            player.fighter.max_hp, mouse.cx, mouse.cy, current_depth, get_names_under_mouse())
+
+
+def render_map_panel():
+    draw_map_panel()
     # blit the contents of console 'con' to the root console (numeral) '0'
-    libtcod.console_blit(stat_con, 0, 0, STAT_PANEL_WIDTH, STAT_PANEL_HEIGHT, 0, 0, 0)
     libtcod.console_blit(con, 0, 0, MAP_WIDTH, MAP_HEIGHT, 0, STAT_PANEL_WIDTH, 0)
+    # take the objects off the console again, so next time they can be drawn wherever they are by then
+    for object in objects:
+        object.clear()
+
+
+def render_messages_panel():
+    libtcod.console_clear(msg_con)
+    draw_messages_panel()
     libtcod.console_blit(msg_con, 0, 0, MSG_PANEL_WIDTH, MSG_PANEL_HEIGHT, 0, 0, MAP_HEIGHT)
 
-    draw_target_tile_highlighter()
 
+def render_stat_panel():
+    libtcod.console_clear(stat_con)
+    draw_stat_panel()
+    libtcod.console_blit(stat_con, 0, 0, STAT_PANEL_WIDTH, STAT_PANEL_HEIGHT, 0, 0, 0)
 
-def draw_map_panel():
-    global fov_recompute
 
-    if fov_recompute:
-        # recompute FOV if needed (the player moved or something)
-        fov_recompute = False
-        libtcod.map_compute_fov(fov_map, player.x, player.y, TORCH_RADIUS, FOV_LIGHT_WALLS, FOV_ALGO)
-
-        for y in xrange(MAP_HEIGHT):
-            for x in xrange(MAP_WIDTH):
-                visible = libtcod.map_is_in_fov(fov_map, x, y)
-                wall = tile_map[x][y].block_sight
-                if not visible:
-                    if tile_map[x][y].explored:
-                        if wall:
-                            libtcod.console_set_char_background(con, x, y, color_dark_wall, libtcod.BKGND_SET)
-                        else:
-                            libtcod.console_set_char_background(con, x, y, color_dark_ground, libtcod.BKGND_SET)
-                else:
-                    if wall:
-                        libtcod.console_set_char_background(con, x, y, color_lit_wall, libtcod.BKGND_SET)
-                    else:
-                        libtcod.console_set_char_background(con, x, y, color_lit_ground, libtcod.BKGND_SET)
-                    tile_map[x][y].explored = True
+render_scheduler = RenderScheduler()
+
+
+def update_fov():
+    # recompute FOV if needed (the player moved or something), and mark everything in view as explored. only the tiles
+    # within the torch radius of where the player was last time and of where they are now can have come into or gone
+    # out of view, so only those are looked at. returns the box (x1, y1, x2, y2) of those tiles, or None if nothing
+    # was recomputed.
+    global fov_recompute, fov_origin
+
+    if not fov_recompute:
+        return None
+    fov_recompute = False
+    libtcod.map_compute_fov(fov_map, player.x, player.y, TORCH_RADIUS, FOV_LIGHT_WALLS, FOV_ALGO)
+
+    if fov_origin is None or not TORCH_RADIUS:
+        x1, y1, x2, y2 = 0, 0, MAP_WIDTH, MAP_HEIGHT
+    else:
+        old_x, old_y = fov_origin
+        x1 = max(min(old_x, player.x) - TORCH_RADIUS, 0)
+        y1 = max(min(old_y, player.y) - TORCH_RADIUS, 0)
+        x2 = min(max(old_x, player.x) + TORCH_RADIUS + 1, MAP_WIDTH)
+        y2 = min(max(old_y, player.y) + TORCH_RADIUS + 1, MAP_HEIGHT)
+    fov_origin = (player.x, player.y)
+
+    in_view = libtcod.map_get_fov(fov_map)[y1:y2, x1:x2].T
+    visible_tiles[x1:x2, y1:y2] = in_view
+    tile_map.explored[x1:x2, y1:y2] |= in_view
+    # monsters that come into view wake up, and so do the ones that can see the player from where they are
+    scheduler.wake_where(in_view, x1, y1)
+    wake_watchers()
+    return x1, y1, x2, y2
+
+
+vision_pool = None
+
+
+def wake_watchers():
+    # the player not seeing a monster doesn't mean it can't see the player (fov isn't symmetric), so look from every
+    # sleeping monster in range too, all in one batch
+    global vision_pool
+
+    watchers = [actor for actor in scheduler.sleeping
+                if not visible_tiles[actor.x, actor.y] and actor.distance_to_object(player) <= TORCH_RADIUS]
+    if not watchers:
+        return
+    pool = None
+    if len(watchers) > VISION_WORKERS:
+        if vision_pool is None:
+            vision_pool = multiprocessing.pool.ThreadPool(VISION_WORKERS)
+        pool = vision_pool
+    views = libtcod.map_compute_fov_batch(fov_map, [(watcher.x, watcher.y) for watcher in watchers], TORCH_RADIUS,
+                                          FOV_LIGHT_WALLS, FOV_ALGO, pool, VISION_WORKERS)
+    for watcher, view in zip(watchers, views):
+        if view[player.y, player.x]:
+            # it comes after the player from where it saw them, as if they had made a noise there
+            if isinstance(watcher.AI, BasicMonster):
+                watcher.AI.noise = (player.x, player.y)
+            scheduler.wake(watcher)
+
+
+def make_noise(x, y, radius):
+    # wake up the sleeping monsters within earshot of (x, y), and send them to have a look
+    x1, y1 = max(x - radius, 0), max(y - radius, 0)
+    x2, y2 = min(x + radius + 1, MAP_WIDTH), min(y + radius + 1, MAP_HEIGHT)
+    dx = numpy.arange(x1, x2)[:, numpy.newaxis] - x
+    dy = numpy.arange(y1, y2)[numpy.newaxis, :] - y
+    for actor in scheduler.wake_where(dx ** 2 + dy ** 2 <= radius ** 2, x1, y1):
+        if isinstance(actor.AI, BasicMonster):
+            actor.AI.noise = (x, y)
+
+
+def draw_map_panel():
+    box = update_fov()
+    if box is not None:
+        map_renderer.draw(con, visible_tiles, tile_map, lighting, box)
 
     for object in objects:
         visible = libtcod.map_is_in_fov(fov_map, object.x, object.y)
-        if (visible or (object.always_visible and tile_map[object.x][object.y].explored)) \
+        if (visible or (object.always_visible and tile_map.explored[object.x, object.y])) \
                 and object is not player:
             object.draw()
     player.draw()
 
 
+class MapRenderer:
+    # draws the background colours of the map panel. it remembers what every cell looked like last time, so only cells
+    # whose colour changed get sent to the console. a few of them are set one by one, more than that and the whole
+    # background is sent with a single fill.
+    MAX_SINGLE_CELLS = 128
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        # the console background as it was last drawn
+        self.cells = libtcod.ConsoleArrays(width, height)
+        self.dark_colors = libtcod.colors_array([color_dark_ground, color_dark_wall]).astype(numpy.float32)
+        self.lit_colors = libtcod.colors_array([color_lit_ground, color_lit_wall]).astype(numpy.float32)
+        # whether the next draw has to look at the whole map, not just the box it is given
+        self.invalid = True
+
+    def invalidate(self):
+        self.invalid = True
+
+    def draw(self, console, visible, tile_map, lighting, box=None):
+        # recolour the cells that changed, looking only inside box (x1, y1, x2, y2) if one is given. tiles in view go
+        # from their dark colour to their lit one (and beyond) with the light falling on them.
+        if box is None or self.invalid:
+            box = (0, 0, self.width, self.height)
+            self.invalid = False
+        x1, y1, x2, y2 = box
+        wall = tile_map.block_sight[x1:x2, y1:y2].astype(int)
+        dark = self.dark_colors[wall]
+        lit = dark + (self.lit_colors[wall] - dark) * lighting.light(x1, y1, x2, y2)
+        colors = numpy.where(visible[x1:x2, y1:y2, numpy.newaxis], lit, dark)
+        colors *= tile_map.explored[x1:x2, y1:y2, numpy.newaxis]
+        # [x, y] to the console's [y, x]
+        colors = numpy.clip(colors, 0, 255).astype(numpy.intc).transpose(1, 0, 2)
+
+        drawn = self.cells.back[y1:y2, x1:x2]
+        ys, xs = numpy.nonzero((colors != drawn).any(axis=-1))
+        if not len(xs):
+            return
+        colors = colors[ys, xs]
+        drawn[ys, xs] = colors
+        xs += x1
+        ys += y1
+
+        if len(xs) <= MapRenderer.MAX_SINGLE_CELLS:
+            for x, y, (r, g, b) in zip(xs.tolist(), ys.tolist(), colors.tolist()):
+                libtcod.console_set_char_background(console, x, y, libtcod.Color(r, g, b))
+        else:
+            self.cells.flush(console, fill_fore=False, fill_char=False)
+
+
+class Lighting:
+    # the light falling on the map: the player's torch, and flashes that last a few turns. how a light fades with
+    # distance is worked out once per radius, so lighting any number of tiles is one array operation per light.
+    kernels = {}
+
+    def __init__(self):
+        # [x, y, radius, colour as an array, turns left]
+        self.flashes = []
+
+    @staticmethod
+    def kernel(radius):
+        # the brightness of a light of this radius around it, from 1 where it is to nothing past radius, indexed
+        # [radius + dx, radius + dy]
+        if radius not in Lighting.kernels:
+            offsets = numpy.arange(-radius, radius + 1, dtype=numpy.float32)
+            distances = offsets[:, numpy.newaxis] ** 2 + offsets[numpy.newaxis, :] ** 2
+            Lighting.kernels[radius] = numpy.maximum(1 - distances / (radius + 1) ** 2, 0)
+        return Lighting.kernels[radius]
+
+    def flash(self, x, y, radius, color, turns=FLASH_TURNS):
+        self.flashes.append([x, y, radius, libtcod.colors_array(color) / numpy.float32(255), turns])
+
+    def tick(self):
+        # a turn went by. returns whether any flash went out.
+        for flash in self.flashes:
+            flash[4] -= 1
+        count = len(self.flashes)
+        self.flashes = [flash for flash in self.flashes if flash[4] > 0]
+        return len(self.flashes) != count
+
+    def sources(self):
+        # every light as (x, y, radius, colour)
+        yield player.x, player.y, TORCH_RADIUS, numpy.ones(3, dtype=numpy.float32)
+        for x, y, radius, color, turns in self.flashes:
+            yield x, y, radius, color
+
+    def light(self, x1, y1, x2, y2):
+        # the light falling on the tiles from (x1, y1) up to (x2, y2), as red, green and blue brightness indexed
+        # [x, y, channel], where 1 is a tile at full brightness (and more is brighter still)
+        light = numpy.zeros((x2 - x1, y2 - y1, 3), dtype=numpy.float32)
+        for x, y, radius, color in self.sources():
+            # the part of the light's kernel that falls inside the box
+            left, top = max(x - radius, x1), max(y - radius, y1)
+            right, bottom = min(x + radius + 1, x2), min(y + radius + 1, y2)
+            if left >= right or top >= bottom:
+                continue
+            kernel = Lighting.kernel(radius)[left - x + radius:right - x + radius, top - y + radius:bottom - y + radius]
+            light[left - x1:right - x1, top - y1:bottom - y1] += kernel[:, :, numpy.newaxis] * color
+        return light
+
+
 def draw_messages_panel():
     # draw the boundary of the panel with a gold line
     old_foreground_color = libtcod.console_get_default_foreground(msg_con)
@@ -961,15 +2275,11 @@ def draw_messages_panel():
     libtcod.console_hline(msg_con, 0, 0, MSG_PANEL_WIDTH)
     libtcod.console_set_default_foreground(msg_con, old_foreground_color)
 
-    # print the last many messages to the message console that will fit in the console.
-    for i, msg_and_color in enumerate(reversed(messages)):
-        if (i + 1) > MSG_PANEL_HEIGHT:
-            break
-        else:
-            msg, color = msg_and_color
-            libtcod.console_set_default_foreground(msg_con, color)
-            libtcod.console_print(msg_con, 1, (i + 1), msg)
-            libtcod.console_set_default_foreground(msg_con, old_foreground_color)
+    # print as many of the latest message lines as fit below the boundary
+    for i, (msg, color) in enumerate(messages.lines(MSG_PANEL_WIDTH, MSG_PANEL_HEIGHT - 1)):
+        libtcod.console_set_default_foreground(msg_con, color)
+        libtcod.console_print(msg_con, 1, (i + 1), msg)
+        libtcod.console_set_default_foreground(msg_con, old_foreground_color)
 
 
 def draw_stat_panel():
@@ -1007,6 +2317,8 @@ def menu(header, options, width, x=-1, y=-1):
     global key
     if len(options) > 26:
         raise ValueError('Cannot have a menu with more than 26 options (a to z).')
+    if script is not None:
+        return scripted_menu_choice(options)
 
     # calculate total height for the header (after auto-wrap) and one line per option
     header_height = libtcod.console_get_height_rect(con, 0, 0, width, MAP_HEIGHT, header)
@@ -1037,6 +2349,8 @@ def menu(header, options, width, x=-1, y=-1):
 
     libtcod.console_flush()
     key = libtcod.console_wait_for_keypress(True)
+    # the menu is still on screen, wherever it was drawn over
+    render_scheduler.invalidate()
 
     print chr(key.c)
     index = key.c - ord('a')
@@ -1066,14 +2380,6 @@ def debug_menu(header):
     pass
 
 
-def clear_all():
-    # clear all objects in the objects list
-    for object in objects:
-        object.clear()
-    libtcod.console_clear(msg_con)
-    libtcod.console_clear(stat_con)
-
-
 def clear_all_consoles():
     libtcod.console_clear(msg_con)
     libtcod.console_clear(stat_con)
@@ -1083,7 +2389,7 @@ def clear_all_consoles():
 
 def mouse_can_see(obj):
     (x, y) = (mouse.cx - STAT_PANEL_WIDTH, mouse.cy)
-    return (obj.always_visible and tile_map[x][y].explored) or libtcod.map_is_in_fov(fov_map, obj.x, obj.y)
+    return (obj.always_visible and tile_map.explored[x, y]) or libtcod.map_is_in_fov(fov_map, obj.x, obj.y)
 
 
 def quantity_and_name_if_item_and_more_than_one_else_name(obj):
@@ -1094,23 +2400,34 @@ def quantity_and_name_if_item_and_more_than_one_else_name(obj):
 def get_names_under_mouse():
     # return a string with the names of all objects under the mouse
     (x, y) = (mouse.cx - STAT_PANEL_WIDTH, mouse.cy)
-    names = [quantity_and_name_if_item_and_more_than_one_else_name(obj) for obj in objects if (obj.x, obj.y) == (x, y)
-             and mouse_can_see(obj)]
+    names = [quantity_and_name_if_item_and_more_than_one_else_name(obj) for obj in objects.at(x, y)
+             if mouse_can_see(obj)]
     names = ', '.join(names)
     return names
 
 
 def initialize_fov():
-    global fov_recompute, fov_map
-    fov_recompute = True
+    global fov_map
 
-    # create fov map based on current tile_map (which must already be generated
+    # create fov map based on current tile_map (which must already be generated). the map's layers are indexed
+    # [x, y] while libtcod wants rows, hence the transposes.
     fov_map = libtcod.map_new(MAP_WIDTH, MAP_HEIGHT)
-    for y in xrange(MAP_HEIGHT):
-        for x in xrange(MAP_WIDTH):
-            libtcod.map_set_properties(fov_map, x, y, not tile_map[x][y].block_sight, not tile_map[x][y].blocked)
+    libtcod.map_fill_properties(fov_map, ~tile_map.block_sight.T, ~tile_map.blocked.T)
+    reset_map_panel()
 
-    libtcod.console_clear(con)
+
+def reset_map_panel():
+    # draw the map panel from scratch next time, for a level that was just entered
+    global fov_recompute, fov_origin, visible_tiles, map_renderer, lighting
+    fov_recompute = True
+    fov_origin = None
+    visible_tiles = numpy.zeros((MAP_WIDTH, MAP_HEIGHT), dtype=bool)
+
+    # the console starts out blank, so the renderer has to start from scratch as well
+    if not headless:
+        libtcod.console_clear(con)
+    map_renderer = MapRenderer(MAP_WIDTH, MAP_HEIGHT)
+    lighting = Lighting()
 
 
 ################################
@@ -1125,14 +2442,14 @@ def play_game():
 
     mouse = libtcod.Mouse()
     key = libtcod.Key()
+    render_scheduler.invalidate()
 
     while not libtcod.console_is_window_closed():
+        render_scheduler.render()
 
-        libtcod.sys_check_for_event(libtcod.EVENT_KEY_PRESS | libtcod.EVENT_MOUSE, key, mouse)
-
-        draw_all()
-        libtcod.console_flush()
-        clear_all()
+        # nothing on screen changes until the player does something, so wait for that rather than redrawing the
+        # same frame over and over
+        libtcod.sys_wait_for_event(libtcod.EVENT_KEY_PRESS | libtcod.EVENT_MOUSE, key, mouse, False)
 
         # handle keys and exit game if needed
         player_action = handle_keys()
@@ -1141,9 +2458,25 @@ def play_game():
             break
 
         if game_state == 'playing' and player_action != 'didnt-take-turn':
-            for object in objects:
-                if object.AI:
-                    object.AI.take_turn()
+            take_monster_turns()
+
+
+def take_monster_turns():
+    global fov_recompute
+    # let every monster whose turn comes up before the player's next one take it
+    scheduler.run(scheduler.time + scheduler.turn_length(player))
+    if lighting.tick():
+        fov_recompute = True
+
+
+def schedule_actors():
+    # start the turns of everything on a level that was just entered
+    global scheduler
+
+    scheduler = TurnScheduler(MAP_WIDTH, MAP_HEIGHT)
+    for object in objects:
+        if object.AI:
+            scheduler.add(object)
 
 
 def main_menu():
@@ -1173,4 +2506,113 @@ def main_menu():
             break
 
 
-main_menu()
+#######################
+# HEADLESS SIMULATION #
+#######################
+
+# commands a script can use for the keys that aren't characters. every other command is a single character typed
+# by the player ('g', 'i', '<', the letter of a menu option...), or, when the game asks for a target tile, an (x, y)
+# tuple or None to cancel.
+scripted_keys = {'up': libtcod.KEY_UP,
+                 'down': libtcod.KEY_DOWN,
+                 'left': libtcod.KEY_LEFT,
+                 'right': libtcod.KEY_RIGHT,
+                 'wait': libtcod.KEY_KP5,
+                 'escape': libtcod.KEY_ESCAPE}
+
+
+def press_scripted_key(command):
+    if command in scripted_keys:
+        key.vk, key.c = scripted_keys[command], 0
+    else:
+        key.vk, key.c = libtcod.KEY_CHAR, ord(command)
+
+
+def scripted_menu_choice(options):
+    # the next command picks a menu option by its letter; anything else (or the end of the script) cancels
+    command = next(script, None)
+    if not isinstance(command, str) or len(command) != 1:
+        return None
+    index = ord(command) - ord('a')
+    if 0 <= index < len(options):
+        return index
+    return None
+
+
+def scripted_target_tile(max_range=None):
+    # the next command is the tile to target, with the same restrictions as clicking one
+    command = next(script, None)
+    # anything but an (x, y) tuple (or the end of the script) cancels, like pressing escape
+    if isinstance(command, tuple) and len(command) == 2:
+        (x, y) = command
+        if in_map(x, y) and libtcod.map_is_in_fov(fov_map, x, y) and \
+                (max_range is None or player.distance_to_tile(x, y) <= max_range):
+            return (x, y)
+    message('Targeting cancelled by player.', color=libtcod.orange)
+    return (None, None)
+
+
+def play_headless(commands, max_turns=None):
+    # play the current game without drawing anything, taking the player's input from commands instead of the keyboard
+    # and mouse. stops when the commands run out, the player dies or quits, or after max_turns turns. returns the
+    # number of turns taken.
+    global key, mouse, script, player_action
+
+    key = libtcod.Key()
+    mouse = libtcod.Mouse()
+    script = iter(commands)
+    turns = 0
+    try:
+        for command in script:
+            if game_state != 'playing' or (max_turns is not None and turns >= max_turns):
+                break
+            update_fov()
+
+            press_scripted_key(command)
+            player_action = handle_keys()
+            if player_action == 'exit':
+                break
+
+            if game_state == 'playing' and player_action != 'didnt-take-turn':
+                take_monster_turns()
+                turns += 1
+    finally:
+        script = None
+    return turns
+
+
+def random_commands():
+    # an endless stream of random moves, with the odd pick up and item use thrown in
+    moves = ['up', 'down', 'left', 'right', 'wait']
+    while True:
+        dice = libtcod.random_get_int(0, 0, 99)
+        if dice < 90:
+            yield moves[dice % len(moves)]
+        elif dice < 95:
+            yield 'g'
+        else:
+            yield 'i'
+            yield chr(ord('a') + libtcod.random_get_int(0, 0, 3))
+
+
+def simulate_game(commands=None, max_turns=1000):
+    # start a new game and play it headless, see play_headless. returns a summary of how it went.
+    if commands is None:
+        commands = random_commands()
+    new_game()
+    turns = play_headless(commands, max_turns)
+    return {'turns': turns, 'game_state': game_state, 'depth': current_depth, 'hp': player.fighter.hp,
+            'inventory': len(inventory)}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--headless':
+        # python myfirstrl.py --headless [number of games] [turns per game]
+        num_games = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+        max_turns = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+        for i in xrange(num_games):
+            result = simulate_game(max_turns=max_turns)
+            print 'game %d: %s' % (i, ', '.join('%s=%s' % item for item in sorted(result.items())))
+    else:
+        init_window()
+        main_menu()